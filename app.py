@@ -9,6 +9,15 @@ import individual_analysis
 import multiomics_integration
 import degenerative_marker
 import pathway_analysis
+import export
+
+# plotly imports orjson lazily on the first serialization; concurrent first
+# requests in a threaded worker can then see a half-initialized module.
+# Importing it here, in the preloaded master, avoids that race.
+try:
+    import orjson  # noqa: F401
+except ImportError:
+    pass
 
 # Initialize app
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.FLATLY], suppress_callback_exceptions=True)
@@ -27,8 +36,13 @@ preprocessing_layout = html.Div([
     dcc.RadioItems(id='missing-value-method', options=[
         {'label': 'Mean', 'value': 'mean'},
         {'label': 'Median', 'value': 'median'},
-        {'label': 'Drop', 'value': 'drop'}
+        {'label': 'Drop', 'value': 'drop'},
+        {'label': 'KNN', 'value': 'knn'},
+        {'label': 'Iterative SVD', 'value': 'svd'}
     ], labelStyle={'display': 'block', 'color': 'white'}),
+    dcc.Checklist(id='batch-correction', options=[
+        {'label': 'Correct batch effects (requires a Batch column)', 'value': 'combat'}
+    ], value=[], labelStyle={'display': 'block', 'color': 'white'}),
     dbc.Button("Run Preprocessing", id='run-preprocessing', color='success'),
     html.Div(id='preprocessing-output'),
     html.Br(),
@@ -48,7 +62,10 @@ documentation_layout = html.Div([
         html.Li("Detect and visualize critical markers.", style={'color': 'white'})
     ]),
     html.Br(),
-    html.P("Supported file types: .csv, .xlsx", style={'color': 'white'})
+    html.P("Supported file types: .csv, .xlsx", style={'color': 'white'}),
+    html.P("For integration, a single .xlsx workbook with transcriptomics, metabolomics and lipidomics on separate sheets is also accepted.", style={'color': 'white'}),
+    html.P("Pathway analysis maps gene, metabolite and lipid names with a local identifier index (build one per organism with `python identifiers.py build <organism> <tables.tsv>`); only genes are sent to g:Profiler.", style={'color': 'white'}),
+    html.P("After marker detection, 'Build Biomarker Panel' runs nested cross-validated L1 / elastic-net logistic models on the same matrix and reports AUC and how often each feature is selected.", style={'color': 'white'})
 ])
 
 # Team layout
@@ -143,14 +160,20 @@ def render_tab(tab):
     State('upload-data', 'filename'),
     State('normalization-method', 'value'),
     State('missing-value-method', 'value'),
+    State('batch-correction', 'value'),
     prevent_initial_call=True
 )
-def run_preprocessing(n, contents, filename, norm, missing):
+def run_preprocessing(n, contents, filename, norm, missing, batch_correction):
     if contents is None or filename is None:
         return "❌ No file uploaded.", None
     try:
         df = utils.parse_uploaded_file(contents, filename)
+        if batch_correction and 'Batch' not in df.columns:
+            return "❌ 'Batch' column is required for batch correction.", None
+        batch = df.pop('Batch') if 'Batch' in df.columns else None
         df = processing.handle_missing_values(df, method=missing)
+        if batch is not None:
+            batch = batch.loc[df.index]
         if norm == 'log2':
             df = processing.normalize_transcriptomics(df)
         elif norm == 'log10':
@@ -159,28 +182,27 @@ def run_preprocessing(n, contents, filename, norm, missing):
             df = processing.normalize_lipidomics(df)
         else:
             return "⚠️ Please select a normalization method.", None
+        if batch_correction:
+            covariates = df['Group'] if 'Group' in df.columns else None
+            df = processing.correct_batch_effects(df, batch, covariates=covariates)
+        if batch is not None:
+            df['Batch'] = batch
 
         table = dash_table.DataTable(columns=[{"name": i, "id": i} for i in df.columns], data=df.head(10).to_dict('records'))
-        df.to_csv("preprocessed_output.csv", index=False)
+        dataset_id = export.store_dataset(df, 'preprocessed_output', {
+            'normalization': norm, 'missing_values': missing, 'batch_correction': bool(batch_correction)
+        }, source_contents=contents, source_filename=filename)
         download_button = html.Div([
             html.Br(),
             html.Hr(),
             html.H4("⬇️ Download Processed Data"),
-            dbc.Button("Download CSV", id="btn-download-preprocessed", color="info"),
-            dcc.Download(id="download-preprocessed")
+            export.download_buttons(dataset_id)
         ])
         return table, download_button
     except Exception as e:
         return f"❌ Error during preprocessing: {str(e)}", None
 
-@app.callback(
-    Output("download-preprocessed", "data"),
-    Input("btn-download-preprocessed", "n_clicks"),
-    prevent_initial_call=True
-)
-def generate_download(n_clicks):
-    return dcc.send_file("preprocessed_output.csv")
-
+export.register_export_routes(server)
 individual_analysis.register_individual_analysis_callbacks(app)
 multiomics_integration.register_multiomics_integration_callbacks(app)
 degenerative_marker.register_degenerative_marker_callbacks(app)
@@ -4,8 +4,22 @@ import dash_bootstrap_components as dbc
 import pandas as pd
 import numpy as np
 import plotly.express as px
-from scipy.stats import ttest_ind
+import plotly.graph_objects as go
+from scipy.stats import ttest_ind_from_stats
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import roc_auc_score, roc_curve
+from sklearn.model_selection import StratifiedKFold
+from sklearn.exceptions import ConvergenceWarning
+from sklearn.svm import l1_min_c
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import hashlib
+import warnings
+import export
+import processing
+import storage
 import utils
+import versioning
 import plotly.io as pio
 
 # Layout for Degenerative Marker Detection
@@ -39,15 +53,284 @@ degenerative_marker_layout = html.Div([
     ]),
     html.Br(),
 
+    html.Div([
+        html.Label("Versioned Dataset (optional)", style={'color': 'white'}),
+        dcc.Input(id='marker-dataset-name', type='text', placeholder='e.g. pd-cohort', debounce=True, style={'width': '100%'}),
+        html.Small("When set, the upload is appended to this dataset as a new version and markers are refreshed from running group statistics.", style={'color': '#d4d4d4'})
+    ]),
+    html.Br(),
+
+    utils.prefilter_controls('marker-prefilter'),
+    html.Br(),
+
     dbc.Button("🔍 Identify Markers", id='run-marker-analysis', color="danger", style={'width': '100%'}),
     html.Br(), html.Br(),
 
     html.Div(id='marker-volcano-plot'),
     html.Br(),
     html.Div(id='marker-output'),
-    html.Div(id='download-marker-section')
+    html.Div(id='download-marker-section'),
+    dcc.Store(id='marker-dataset-version'),
+    html.Div(id='marker-dataset-versions'),
+    html.Br(),
+
+    html.H4("🗺️ Clustered Heatmap of Top Markers", style={'color': 'white'}),
+    dbc.Row([
+        dbc.Col([
+            html.Label("Top-N Markers", style={'color': 'white'}),
+            dcc.Input(id='heatmap-top-n', type='number', min=2, max=500, step=1, value=50)
+        ], width=3),
+        dbc.Col([
+            html.Label("Color Scale", style={'color': 'white'}),
+            dcc.Dropdown(id='heatmap-colorscale', options=[
+                {'label': 'Red-Blue', 'value': 'RdBu_r'},
+                {'label': 'Viridis', 'value': 'Viridis'},
+                {'label': 'Cividis', 'value': 'Cividis'}
+            ], value='RdBu_r', clearable=False)
+        ], width=3),
+        dbc.Col([
+            dcc.Checklist(id='heatmap-clustering', options=[
+                {'label': 'Cluster samples', 'value': 'samples'},
+                {'label': 'Cluster features', 'value': 'features'}
+            ], value=['samples', 'features'], labelStyle={'display': 'block', 'color': 'white'})
+        ], width=3)
+    ]),
+    dcc.Store(id='marker-result-id'),
+    html.Div(id='marker-heatmap'),
+    html.Br(),
+
+    html.H4("🧬 Biomarker Panel (Nested Cross-Validation)", style={'color': 'white'}),
+    dbc.Row([
+        dbc.Col([
+            html.Label("Penalty", style={'color': 'white'}),
+            dcc.Dropdown(id='panel-penalty', options=[
+                {'label': 'L1 (Lasso)', 'value': 'l1'},
+                {'label': 'Elastic-Net', 'value': 'elasticnet'}
+            ], value='l1', clearable=False)
+        ], width=3),
+        dbc.Col([
+            html.Label("Outer Folds", style={'color': 'white'}),
+            dcc.Input(id='panel-outer-folds', type='number', min=2, max=10, step=1, value=5)
+        ], width=3),
+        dbc.Col([
+            html.Label("Screened Features per Fold", style={'color': 'white'}),
+            dcc.Input(id='panel-screen-n', type='number', min=10, step=10, value=1000)
+        ], width=4)
+    ]),
+    html.Br(),
+    dbc.Button("🧬 Build Biomarker Panel", id='run-marker-panel', color="warning", style={'width': '100%'}),
+    html.Br(), html.Br(),
+    dcc.Loading(html.Div(id='marker-panel'))
 ])
 
+# --- Marker Statistics ---
+def marker_statistics(summary, group_labels, features, p_thresh, fc_thresh):
+    # Welch t-test and fold change for every feature from per-group counts,
+    # means and M2 (see processing.summarize_groups)
+    s1, s2 = summary[group_labels[0]], summary[group_labels[1]]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        std1 = np.sqrt(s1['m2'] / (s1['n'] - 1))
+        std2 = np.sqrt(s2['m2'] / (s2['n'] - 1))
+        stat, pvals = ttest_ind_from_stats(s1['mean'], std1, s1['n'], s2['mean'], std2, s2['n'], equal_var=False)
+        fold_changes = (s1['mean'] + 1e-6) / (s2['mean'] + 1e-6)
+        log_fc = np.log2(fold_changes)
+        log_p = -np.log10(pvals)
+    regulation = np.where((pvals < p_thresh) & (log_fc > np.log2(fc_thresh)), 'Up',
+                          np.where((pvals < p_thresh) & (log_fc < -np.log2(fc_thresh)), 'Down', 'NS'))
+
+    return pd.DataFrame({
+        'Feature': list(features),
+        'p-value': pvals,
+        'Fold Change': fold_changes,
+        'log2(FC)': log_fc,
+        '-log10(p)': log_p,
+        'Regulation': regulation
+    })
+
+# --- Clustered Heatmap ---
+# Marker results live in the shared store, keyed by result ID, so any worker
+# can serve the heatmap for them.
+def _store_marker_result(result_id, matrix, groups, result_df, dataset=None):
+    # Versioned datasets are stored as (name, version) and only loaded if the
+    # heatmap or panel needs them; later appends are not part of the result
+    storage.put('marker-results', result_id, (matrix, groups, result_df, dataset))
+
+@lru_cache(maxsize=32)
+def _clustered_markers(result_id, top_n):
+    # Linkage depends only on the result and N, so color or ordering changes
+    # reuse it instead of reclustering.
+    return storage.memoize('marker-heatmap', (result_id, top_n),
+                           lambda: _cluster_top_markers(result_id, top_n))
+
+def _cluster_top_markers(result_id, top_n):
+    result_df = storage.get('marker-results', result_id)[2]
+    matrix, groups = _load_marker_matrix(result_id)
+    ranked = result_df.dropna(subset=['p-value'])
+    significant = ranked[ranked['Regulation'] != 'NS']
+    ranked = significant if len(significant) >= 2 else ranked
+    top = ranked.nsmallest(top_n, 'p-value')['Feature'].tolist()
+    values = matrix[top].to_numpy(dtype=float)
+    values = np.where(np.isnan(values), np.nanmean(values, axis=0), values)
+    std = values.std(axis=0)
+    zscores = ((values - values.mean(axis=0)) / np.where(std > 0, std, 1.0)).T
+    return zscores, top, groups, processing.cluster_order(zscores), processing.cluster_order(zscores.T)
+
+def build_marker_heatmap(result_id, top_n, clustering, colorscale, max_rows=100, max_cols=200):
+    zscores, features, groups, feature_order, sample_order = _clustered_markers(result_id, top_n)
+    rows = feature_order if 'features' in clustering else np.arange(len(features))
+    cols = sample_order if 'samples' in clustering else np.arange(zscores.shape[1])
+    display, row_bins, col_bins = processing.downsample_matrix(zscores[np.ix_(rows, cols)], max_rows, max_cols)
+
+    def bin_label(names, b):
+        return names[b[0]] if len(b) == 1 else f"{names[b[0]]} … {names[b[-1]]} ({len(b)})"
+
+    feature_names = [features[i] for i in rows]
+    sample_names = [f"{groups.index[i]} ({groups.iloc[i]})" for i in cols]
+    fig = go.Figure(go.Heatmap(
+        z=display,
+        x=[bin_label(sample_names, b) for b in col_bins],
+        y=[bin_label(feature_names, b) for b in row_bins],
+        colorscale=colorscale, zmid=0 if colorscale == 'RdBu_r' else None,
+        colorbar=dict(title='z-score')
+    ))
+    fig.update_layout(template='plotly_white', title='Clustered Heatmap of Top Markers',
+                      height=max(400, 12 * len(row_bins) + 200), xaxis=dict(showticklabels=len(col_bins) <= 60))
+    return fig
+
+# --- Biomarker Panel ---
+# Nested cross-validation of sparse logistic models: the inner folds pick the
+# penalty strength, the outer folds give an unbiased AUC and show how often
+# each feature ends up in the panel.
+PANEL_L1_RATIOS = {'l1': (1.0,), 'elasticnet': (0.2, 0.5, 0.8)}
+PANEL_N_CS = 10
+PANEL_C_RANGE = 3  # decades above the smallest C that selects any feature
+PANEL_MAX_ITER = 300
+
+def _screen_and_scale(X, y, train, test, screen_n):
+    # Screening, imputation and scaling are fit on the training rows only, so
+    # every validation split is scored on features it had no say in choosing
+    summary = processing.summarize_groups(pd.DataFrame(X[train]), y[train])
+    s0, s1 = summary[False], summary[True]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stat, _ = ttest_ind_from_stats(s1['mean'], np.sqrt(s1['m2'] / (s1['n'] - 1)), s1['n'],
+                                       s0['mean'], np.sqrt(s0['m2'] / (s0['n'] - 1)), s0['n'], equal_var=False)
+    keep = np.argsort(-np.nan_to_num(np.abs(stat), nan=-1.0), kind='stable')[:screen_n]
+    pooled = processing.merge_summaries(s0, s1)
+    mean = np.nan_to_num(pooled['mean'][keep])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        std = np.sqrt(pooled['m2'][keep] / pooled['n'][keep])
+    std = np.where(np.nan_to_num(std) > 0, std, 1.0)
+
+    def scale(rows):
+        Z = (X[np.ix_(rows, keep)] - mean) / std
+        return np.where(np.isnan(Z), 0.0, Z)
+
+    Z_train = scale(train)
+    # The C grid is relative to the smallest C that selects any feature, so a
+    # grid position means the same sparsity level on every split
+    Cs = l1_min_c(Z_train, y[train], loss='log') * np.logspace(0, PANEL_C_RANGE, PANEL_N_CS)
+    return keep, Z_train, scale(test), Cs
+
+def _fit_path(Z, y, Cs, l1_ratio):
+    # From the strongest penalty to the weakest, each fit starting from the
+    # previous coefficients
+    model = LogisticRegression(penalty='elasticnet', solver='saga', l1_ratio=l1_ratio,
+                               warm_start=True, max_iter=PANEL_MAX_ITER, tol=1e-3)
+    for C in Cs:
+        yield model.set_params(C=C * l1_ratio).fit(Z, y)
+
+def _inner_path_auc(X, y, train, val, screen_n, l1_ratios):
+    # AUC at every grid position, one row per l1 ratio
+    keep, Z_train, Z_val, Cs = _screen_and_scale(X, y, train, val, screen_n)
+    return np.array([[roc_auc_score(y[val], model.decision_function(Z_val))
+                      for model in _fit_path(Z_train, y[train], Cs, l1_ratio)]
+                     for l1_ratio in l1_ratios])
+
+def _refit_panel_fold(X, y, train, test, screen_n, l1_ratio, c_index):
+    keep, Z_train, Z_test, Cs = _screen_and_scale(X, y, train, test, screen_n)
+    for model in _fit_path(Z_train, y[train], Cs[:c_index + 1], l1_ratio):
+        pass
+    return keep, model.coef_[0].copy(), model.predict_proba(Z_test)[:, 1], Cs[c_index] * l1_ratio
+
+def build_biomarker_panel(df, groups, penalty='l1', outer_folds=5, inner_folds=3,
+                          screen_n=1000, n_jobs=None, random_state=0):
+    numeric = df.select_dtypes(include=np.number)
+    features = np.asarray(numeric.columns, dtype=object)
+    X = numeric.to_numpy(dtype=float)
+    groups = np.asarray(groups)
+    labels = pd.unique(groups)
+    if len(labels) != 2:
+        raise ValueError("Exactly 2 groups required for a biomarker panel.")
+    y = groups == labels[1]
+    if min(y.sum(), (~y).sum()) < outer_folds * inner_folds:
+        raise ValueError(f"Each group needs at least {outer_folds * inner_folds} samples for "
+                         f"{outer_folds} x {inner_folds} nested cross-validation.")
+    l1_ratios = PANEL_L1_RATIOS[penalty]
+    outer = list(StratifiedKFold(outer_folds, shuffle=True, random_state=random_state).split(X, y))
+    inner = [[(train[a], train[b]) for a, b in
+              StratifiedKFold(inner_folds, shuffle=True, random_state=random_state).split(train, y[train])]
+             for train, _ in outer]
+
+    # saga releases the GIL, so all folds share one thread pool
+    with warnings.catch_warnings(), ThreadPoolExecutor(max_workers=processing.max_threads(n_jobs)) as pool:
+        warnings.simplefilter('ignore', ConvergenceWarning)
+        jobs = [[pool.submit(_inner_path_auc, X, y, train, val, screen_n, l1_ratios) for train, val in splits]
+                for splits in inner]
+        best = []
+        for fold_jobs in jobs:
+            # Mean inner AUC per (l1 ratio, grid position); ties go to the sparser model
+            scores = np.mean([job.result() for job in fold_jobs], axis=0)
+            r, c_index = np.unravel_index(np.argmax(scores), scores.shape)
+            best.append((r, c_index, scores[r, c_index]))
+        refits = list(pool.map(lambda args: _refit_panel_fold(X, y, args[0][0], args[0][1], screen_n,
+                                                              l1_ratios[args[1][0]], args[1][1]),
+                               zip(outer, best)))
+
+    oof = np.empty(len(y))
+    selected = np.zeros(len(features))
+    coef_sum = np.zeros(len(features))
+    fold_rows = []
+    for i, ((train, test), (r, c_index, inner_auc), (keep, coef, proba, C)) in enumerate(zip(outer, best, refits)):
+        oof[test] = proba
+        nonzero = coef != 0
+        selected[keep[nonzero]] += 1
+        coef_sum[keep[nonzero]] += coef[nonzero]
+        fold_rows.append({
+            'Fold': i + 1,
+            'l1_ratio': l1_ratios[r],
+            'C': C,
+            'Inner AUC': inner_auc,
+            'Outer AUC': roc_auc_score(y[test], proba),
+            'Panel Size': int(nonzero.sum())
+        })
+
+    picked = selected > 0
+    mean_coef = coef_sum[picked] / selected[picked]
+    panel = pd.DataFrame({
+        'Feature': features[picked],
+        'Selection Frequency': selected[picked] / len(outer),
+        'Mean Coefficient': mean_coef,
+        'Higher In': np.where(mean_coef > 0, labels[1], labels[0])
+    })
+    panel = panel.iloc[np.lexsort((-np.abs(panel['Mean Coefficient']), -panel['Selection Frequency']))].reset_index(drop=True)
+    fpr, tpr, _ = roc_curve(y, oof)
+    return {
+        'panel': panel,
+        'folds': pd.DataFrame(fold_rows),
+        'auc': roc_auc_score(y, oof),
+        'roc': (fpr, tpr),
+        'labels': list(labels),
+    }
+
+def _load_marker_matrix(result_id):
+    matrix, groups, result_df, dataset = storage.get('marker-results', result_id)
+    if matrix is None:
+        name, version = dataset
+        matrix = versioning.load_samples(name, version)
+        groups = matrix['Group']
+    return matrix, groups
+
+
 # Callback registration
 def register_degenerative_marker_callbacks(app):
 
@@ -66,56 +349,67 @@ def register_degenerative_marker_callbacks(app):
         Output('marker-output', 'children'),
         Output('marker-volcano-plot', 'children'),
         Output('download-marker-section', 'children'),
+        Output('marker-result-id', 'data'),
+        Output('marker-dataset-version', 'data'),
         Input('run-marker-analysis', 'n_clicks'),
         State('upload-marker-data', 'contents'),
         State('upload-marker-data', 'filename'),
         State('pval-thresh', 'value'),
         State('fc-thresh', 'value'),
+        State('marker-dataset-name', 'value'),
+        *utils.prefilter_states('marker-prefilter'),
         prevent_initial_call=True
     )
-    def run_marker_analysis(n, contents, filename, p_thresh, fc_thresh):
+    def run_marker_analysis(n, contents, filename, p_thresh, fc_thresh, dataset_name, max_missing, min_variance, top_n):
         if contents is None or filename is None:
-            return "❌ No file uploaded.", None, None
+            return "❌ No file uploaded.", None, None, None, None
 
-        df = utils.parse_uploaded_file(contents, filename)
-        df[df.columns.difference(['Group'])] = df[df.columns.difference(['Group'])].apply(pd.to_numeric, errors='coerce')
+        # Reject files without a Group column before parsing all of them
+        try:
+            sniffed = utils.sniff_upload(contents, filename)
+        except Exception as e:
+            return f"❌ Could not read file: {str(e)}", None, None, None, None
+        if sniffed['group_column'] is None:
+            return "❌ 'Group' column missing in data.", None, None, None, None
 
-        if 'Group' not in df.columns:
-            return "❌ 'Group' column missing in data.", None, None
+        df = utils.parse_uploaded_file(contents, filename, sniffed)
+        labels = [c for c in versioning.LABEL_COLUMNS if c in df.columns]
+        df[df.columns.difference(labels)] = df[df.columns.difference(labels)].apply(pd.to_numeric, errors='coerce')
 
+        criteria = utils.prefilter_criteria(max_missing, min_variance, top_n)
         try:
-            features = df.drop(columns=['Group'])
-            group_labels = df['Group'].unique()
-            if len(group_labels) != 2:
-                return "❌ Exactly 2 groups required for comparison.", None, None
-
-            g1 = df[df['Group'] == group_labels[0]]
-            g2 = df[df['Group'] == group_labels[1]]
-
-            pvals, fold_changes = [], []
-            for col in features.columns:
-                stat, pval = ttest_ind(g1[col], g2[col], equal_var=False, nan_policy='omit')
-                fc = (g1[col].mean() + 1e-6) / (g2[col].mean() + 1e-6)
-                pvals.append(pval)
-                fold_changes.append(fc)
-
-            log_fc = np.log2(fold_changes)
-            log_p = -np.log10(pvals)
-            regulation = [
-                'Up' if p < p_thresh and lfc > np.log2(fc_thresh) else
-                'Down' if p < p_thresh and lfc < -np.log2(fc_thresh) else
-                'NS'
-                for p, lfc in zip(pvals, log_fc)
-            ]
-
-            result_df = pd.DataFrame({
-                'Feature': features.columns,
-                'p-value': pvals,
-                'Fold Change': fold_changes,
-                'log2(FC)': log_fc,
-                '-log10(p)': log_p,
-                'Regulation': regulation
-            })
+            dataset_name = (dataset_name or '').strip()
+            if dataset_name:
+                # Append as a new version; statistics come from the merged summaries
+                if df['Group'].nunique() > 2:
+                    return "❌ Exactly 2 groups required for comparison.", None, None, None, None
+                state, appended = versioning.append_samples(dataset_name, df, max_groups=2, source_contents=contents)
+                if len(state['groups']) != 2:
+                    version = {'name': dataset_name, 'version': len(state['versions'])}
+                    return "ℹ️ Samples stored. Markers need samples from both groups.", None, None, None, version
+                group_labels = state['groups']
+                # Filter on the merged summaries so no stored samples are reloaded
+                prefilter_report = processing.select_features(processing.summary_metrics(
+                    state['summary'], state['features'], state['versions'][-1]['n_samples']), **criteria)
+                kept = prefilter_report['kept'].to_numpy()
+                summary = {label: {key: values[kept] for key, values in stats.items()}
+                           for label, stats in state['summary'].items()}
+                feature_names = np.asarray(state['features'], dtype=object)[kept]
+                version = {'name': dataset_name, 'version': len(state['versions'])}
+                result_id = hashlib.sha1(f"{dataset_name}|{version['version']}|{p_thresh}|{fc_thresh}|{criteria}".encode()).hexdigest()
+                notes = [] if appended else [dbc.Alert(f"ℹ️ This upload is already stored in '{dataset_name}'; markers were refreshed without appending it again.", color="info")]
+            else:
+                notes = []
+                group_labels = df['Group'].unique()
+                if len(group_labels) != 2:
+                    return "❌ Exactly 2 groups required for comparison.", None, None, None, None
+                features, prefilter_report = processing.prefilter_features(df.drop(columns=labels), **criteria)
+                summary = processing.summarize_groups(features, df['Group'])
+                feature_names = features.columns
+                version = None
+                result_id = hashlib.sha1(f"{contents}|{p_thresh}|{fc_thresh}|{criteria}".encode()).hexdigest()
+
+            result_df = marker_statistics(summary, group_labels, feature_names, p_thresh, fc_thresh)
 
             color_map = {'Up': 'red', 'Down': 'blue', 'NS': 'gray'}
             fig = px.scatter(result_df, x='log2(FC)', y='-log10(p)',
@@ -144,58 +438,129 @@ def register_degenerative_marker_callbacks(app):
                 dcc.Download(id="download-volcano-svg")
             ])
 
+            dataset_id = export.store_dataset(result_df, 'degenerative_markers', {
+                'p_value_threshold': p_thresh, 'fold_change_threshold': fc_thresh, 'prefilter': criteria
+            }, source_contents=contents, source_filename=filename)
             download_ui = html.Div([
                 html.Hr(),
                 html.H4("⬇️ Download Marker Table"),
-                dbc.Button("Download Marker Table", id="btn-download-markers", color="info"),
-                dcc.Download(id="download-marker-csv")
+                export.download_buttons(dataset_id)
             ])
 
-            return table, html.Div([dcc.Graph(figure=fig), volcano_download_buttons]), download_ui
+            if version is None:
+                _store_marker_result(result_id, features, df['Group'], result_df)
+            else:
+                _store_marker_result(result_id, None, None, result_df, dataset=(dataset_name, version['version']))
+
+            table = html.Div(notes + [html.P(utils.describe_prefilter(prefilter_report), style={'color': 'white'}), table])
+            return table, html.Div([dcc.Graph(figure=fig), volcano_download_buttons]), download_ui, result_id, version
 
         except Exception as e:
-            return f"❌ Error in analysis: {str(e)}", None, None
-
-    @app.callback(Output("download-marker-csv", "data"),
-                  Input("btn-download-markers", "n_clicks"),
-                  State('upload-marker-data', 'contents'),
-                  State('upload-marker-data', 'filename'),
-                  State('pval-thresh', 'value'),
-                  State('fc-thresh', 'value'),
-                  prevent_initial_call=True)
-    def download_marker_table(n, contents, filename, p_thresh, fc_thresh):
-        df = utils.parse_uploaded_file(contents, filename)
-        df[df.columns.difference(['Group'])] = df[df.columns.difference(['Group'])].apply(pd.to_numeric, errors='coerce')
-        features = df.drop(columns=['Group'])
-        group_labels = df['Group'].unique()
-        g1 = df[df['Group'] == group_labels[0]]
-        g2 = df[df['Group'] == group_labels[1]]
-
-        pvals, fold_changes = [], []
-        for col in features.columns:
-            stat, pval = ttest_ind(g1[col], g2[col], equal_var=False, nan_policy='omit')
-            fc = (g1[col].mean() + 1e-6) / (g2[col].mean() + 1e-6)
-            pvals.append(pval)
-            fold_changes.append(fc)
+            return f"❌ Error in analysis: {str(e)}", None, None, None, None
 
-        log_fc = np.log2(fold_changes)
-        regulation = [
-            'Up' if p < p_thresh and lfc > np.log2(fc_thresh) else
-            'Down' if p < p_thresh and lfc < -np.log2(fc_thresh) else
-            'NS'
-            for p, lfc in zip(pvals, log_fc)
-        ]
-
-        result_df = pd.DataFrame({
-            'Feature': features.columns,
-            'p-value': pvals,
-            'Fold Change': fold_changes,
-            'log2(FC)': log_fc,
-            '-log10(p)': -np.log10(pvals),
-            'Regulation': regulation
-        })
+    @app.callback(
+        Output('marker-dataset-versions', 'children'),
+        Input('marker-dataset-version', 'data'),
+        prevent_initial_call=True
+    )
+    def show_dataset_versions(version):
+        if not version:
+            return None
+        state = versioning.load_state(version['name'])
+        if state is None:
+            return None
+        history = dash_table.DataTable(
+            columns=[{"name": c, "id": c} for c in ['version', 'added', 'n_samples', 'created']],
+            data=state['versions'],
+            style_table={'overflowX': 'auto'},
+            style_cell={"textAlign": "left"}
+        )
+        children = [html.Hr(), html.H4(f"🗂️ Dataset '{version['name']}' (version {version['version']})", style={'color': 'white'}), history]
+        scores = versioning.pca_scores(version['name'])
+        if scores is not None and 'PC2' in scores.columns:
+            fig = px.scatter(scores, x='PC1', y='PC2', color='Group', symbol='Version',
+                             title='Incremental PCA - All Versions')
+            fig.update_layout(template='plotly_white')
+            children.append(dcc.Graph(figure=fig))
+        return html.Div(children)
+
+    @app.callback(
+        Output('marker-heatmap', 'children'),
+        Input('marker-result-id', 'data'),
+        Input('heatmap-top-n', 'value'),
+        Input('heatmap-clustering', 'value'),
+        Input('heatmap-colorscale', 'value'),
+        prevent_initial_call=True
+    )
+    def update_marker_heatmap(result_id, top_n, clustering, colorscale):
+        if result_id is None:
+            return None
+        if not storage.contains('marker-results', result_id):
+            return "⚠️ Marker results have expired. Please run the analysis again."
+        try:
+            fig = build_marker_heatmap(result_id, int(top_n or 50), clustering or [], colorscale)
+            return dcc.Graph(figure=fig)
+        except Exception as e:
+            return f"❌ Error building heatmap: {str(e)}"
+
+    @app.callback(
+        Output('marker-panel', 'children'),
+        Input('run-marker-panel', 'n_clicks'),
+        State('marker-result-id', 'data'),
+        State('panel-penalty', 'value'),
+        State('panel-outer-folds', 'value'),
+        State('panel-screen-n', 'value'),
+        prevent_initial_call=True
+    )
+    def run_marker_panel(n, result_id, penalty, outer_folds, screen_n):
+        if result_id is None:
+            return "❌ Run marker identification first."
+        if not storage.contains('marker-results', result_id):
+            return "⚠️ Marker results have expired. Please run the analysis again."
+        outer_folds, screen_n = int(outer_folds or 5), int(screen_n or 1000)
+        try:
+            matrix, groups = _load_marker_matrix(result_id)
+            result = storage.memoize('marker-panels', (result_id, penalty, outer_folds, screen_n),
+                                     lambda: build_biomarker_panel(matrix.drop(columns=['Group'], errors='ignore'), groups,
+                                                                   penalty=penalty, outer_folds=outer_folds, screen_n=screen_n))
+        except Exception as e:
+            return f"❌ Error building panel: {str(e)}"
 
-        return dcc.send_data_frame(result_df.to_csv, filename='degenerative_markers.csv', index=False)
+        panel, folds = result['panel'], result['folds']
+        fpr, tpr = result['roc']
+        fig = go.Figure([
+            go.Scatter(x=fpr, y=tpr, mode='lines', name=f"Out-of-fold (AUC = {result['auc']:.3f})"),
+            go.Scatter(x=[0, 1], y=[0, 1], mode='lines', line=dict(dash='dash', color='gray'), showlegend=False)
+        ])
+        fig.update_layout(template='plotly_white', title=f"ROC - {result['labels'][1]} vs {result['labels'][0]}",
+                          xaxis_title='False Positive Rate', yaxis_title='True Positive Rate', height=500, width=600)
+
+        dataset_id = export.store_dataset(panel, 'biomarker_panel', {
+            'marker_result_id': result_id, 'penalty': penalty, 'outer_folds': outer_folds, 'screened_features': screen_n
+        })
+        return html.Div([
+            dbc.Alert(f"✅ Nested CV AUC: {result['auc']:.3f} (per fold {folds['Outer AUC'].mean():.3f} ± {folds['Outer AUC'].std():.3f}) · "
+                      f"{int((panel['Selection Frequency'] >= 0.5).sum())} features selected in at least half of the folds",
+                      color="success"),
+            dcc.Graph(figure=fig),
+            dash_table.DataTable(
+                columns=[{"name": c, "id": c} for c in folds.columns],
+                data=folds.round(4).to_dict('records'),
+                style_table={'overflowX': 'auto'},
+                style_cell={"textAlign": "left"}
+            ),
+            html.Br(),
+            dash_table.DataTable(
+                columns=[{"name": c, "id": c} for c in panel.columns],
+                data=panel.round(4).to_dict('records'),
+                page_size=20,
+                style_table={'overflowX': 'auto'},
+                style_cell={"textAlign": "left"}
+            ),
+            html.Hr(),
+            html.H4("⬇️ Download Biomarker Panel"),
+            export.download_buttons(dataset_id)
+        ])
 
     @app.callback(Output("download-volcano-png", "data"), Input("btn-download-volcano-png", "n_clicks"), prevent_initial_call=True)
     def download_png(n):
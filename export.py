@@ -0,0 +1,123 @@
+# export.py
+# Streamed exports of stored results and matrices as Parquet, Feather or
+# gzip-compressed CSV, served from /download/<dataset_id>?format=...
+
+import json
+import hashlib
+import datetime
+import zlib
+from flask import Response, abort, request, stream_with_context
+import dash_bootstrap_components as dbc
+from dash import html
+import storage
+
+EXPORT_FORMATS = {
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'feather': ('application/vnd.apache.arrow.file', 'feather'),
+    'csv.gz': ('application/gzip', 'csv.gz'),
+}
+CHUNK_CELLS = 2_000_000
+
+def input_hash(contents):
+    return hashlib.sha256(contents.encode() if isinstance(contents, str) else contents).hexdigest()
+
+def store_dataset(df, name, parameters, source_contents=None, source_filename=None):
+    # Keep the frame in the shared store; files are only produced on download
+    provenance = {
+        'generated_by': 'DegenerOmics',
+        'dataset': name,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'source_filename': source_filename,
+        'input_sha256': input_hash(source_contents) if source_contents is not None else None,
+        'parameters': parameters,
+    }
+    dataset_id = hashlib.sha1(json.dumps(provenance, sort_keys=True, default=str).encode()).hexdigest()
+    storage.put('datasets', dataset_id, {'name': name, 'df': df, 'provenance': provenance})
+    return dataset_id
+
+def download_url(dataset_id, fmt):
+    return f"/download/{dataset_id}?format={fmt}"
+
+def download_buttons(dataset_id):
+    # Plain links so the browser streams the file from the download route
+    return html.Div([
+        dbc.Button("Parquet", href=download_url(dataset_id, 'parquet'), external_link=True, color="info", style={'marginRight': '10px'}),
+        dbc.Button("Feather", href=download_url(dataset_id, 'feather'), external_link=True, color="info", style={'marginRight': '10px'}),
+        dbc.Button("CSV (gzip)", href=download_url(dataset_id, 'csv.gz'), external_link=True, color="info")
+    ])
+
+def _row_chunks(df):
+    step = max(1, CHUNK_CELLS // max(1, df.shape[1]))
+    for start in range(0, len(df), step):
+        yield df.iloc[start:start + step]
+
+class _ChunkSink:
+    # Minimal writable file that hands written bytes back to a generator
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def _stream_arrow(df, provenance, fmt):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    sink = _ChunkSink()
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    schema = schema.with_metadata({**(schema.metadata or {}), b'degenero': json.dumps(provenance).encode()})
+    writer = pq.ParquetWriter(sink, schema) if fmt == 'parquet' else pa.ipc.new_file(sink, schema)
+    try:
+        for chunk in _row_chunks(df):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+def _stream_csv_gz(df, provenance):
+    # Provenance goes in leading '#' lines; read back with pd.read_csv(..., comment='#')
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    header = ''.join(f"# {key}: {json.dumps(value, default=str)}\n" for key, value in provenance.items())
+    yield compressor.compress(header.encode())
+    for i, chunk in enumerate(_row_chunks(df)):
+        yield compressor.compress(chunk.to_csv(index=False, header=(i == 0)).encode())
+    if df.empty:
+        yield compressor.compress(df.to_csv(index=False).encode())
+    yield compressor.flush()
+
+def stream_dataset(df, provenance, fmt):
+    if fmt == 'csv.gz':
+        return _stream_csv_gz(df, provenance)
+    return _stream_arrow(df, provenance, fmt)
+
+def register_export_routes(server):
+    @server.route('/download/<dataset_id>')
+    def download_dataset(dataset_id):
+        fmt = request.args.get('format', 'csv.gz')
+        if fmt not in EXPORT_FORMATS:
+            abort(400)
+        entry = storage.get('datasets', dataset_id)
+        if entry is None:
+            abort(404)
+        mimetype, extension = EXPORT_FORMATS[fmt]
+        return Response(stream_with_context(stream_dataset(entry['df'], entry['provenance'], fmt)),
+                        mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename="{entry["name"]}.{extension}"'})
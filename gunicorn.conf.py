@@ -0,0 +1,38 @@
+# gunicorn.conf.py
+# Production settings for serving app.server: gunicorn -c gunicorn.conf.py app:server
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+
+# Import the app (pandas, scipy, sklearn, plotly) once in the master so workers
+# share those pages copy-on-write instead of each importing them.
+preload_app = True
+
+cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+workers = int(os.environ.get('WEB_CONCURRENCY', min(2 * cpus + 1, 8)))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+
+# Thread pools inside one request (KNN imputation, biomarker panels) use at
+# most DEGENERO_MAX_THREADS threads, by default an even share of the CPUs per
+# worker; BLAS gets the same budget. g:Profiler queries are network-bound and
+# capped separately by GPROFILER_MAX_CONCURRENT (default 8).
+os.environ.setdefault('DEGENERO_MAX_THREADS', str(max(1, cpus // workers)))
+for var in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+    os.environ.setdefault(var, os.environ['DEGENERO_MAX_THREADS'])
+
+# Analyses (imputation, linkage, pathway queries) can run for minutes
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 300))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 60))
+keepalive = 5
+
+# Recycle workers periodically to bound memory growth from large uploads
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 500))
+max_requests_jitter = 50
+
+accesslog = '-'
+errorlog = '-'
+
+# Every worker must see the same cache directory for shared results
+os.environ.setdefault('DEGENERO_CACHE_DIR', os.path.join(os.getcwd(), '.degenero-cache'))
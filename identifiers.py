@@ -0,0 +1,136 @@
+# identifiers.py
+# Local identifier index for mapping gene, metabolite and lipid names without
+# network calls.
+#
+# An index is built once per organism from tab-separated source tables (e.g.
+# HGNC/Ensembl, HMDB and LIPID MAPS exports) with any of the columns
+#   kind, symbol, ensembl, entrez, hmdb, kegg, lipidmaps, synonyms
+# where synonyms are '|'-separated:
+#
+#   python identifiers.py build hsapiens genes.tsv hmdb.tsv lipidmaps.tsv
+#
+# Each organism directory holds three .npy files that are memory-mapped on
+# load: sorted fixed-width keys, the entry row for each key, and the entries.
+
+import os
+import re
+import sys
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+
+INDEX_DIR = os.environ.get('DEGENERO_ID_INDEX_DIR',
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), 'id_index'))
+ID_COLUMNS = ['symbol', 'ensembl', 'entrez', 'hmdb', 'kegg', 'lipidmaps']
+KINDS = ('gene', 'metabolite', 'lipid')
+
+# Fallback routing for names that are not in the index
+_KIND_PATTERNS = [
+    ('gene', re.compile(r'^ENS[A-Z]*G\d+')),
+    ('metabolite', re.compile(r'^HMDB\d+$')),
+    ('metabolite', re.compile(r'^C\d{5}$')),
+    ('lipid', re.compile(r'^LM[A-Z]{2}\d+$')),
+    ('lipid', re.compile(r'^(LYSO)?(L?PC|L?PE|PS|PI|PG|PA|SM|CER|HEXCER|TG|DG|MG|CE|FA)\s*\(?[OP]?-?\d+:\d+')),
+]
+
+def _normalize(names):
+    return [str(name).strip().upper().encode('utf-8') for name in names]
+
+def guess_kind(name):
+    normalized = str(name).strip().upper()
+    for kind, pattern in _KIND_PATTERNS:
+        if pattern.match(normalized):
+            return kind
+    return 'unknown'
+
+# --- Building ---
+def build_index(records, out_dir):
+    records = records.reset_index(drop=True)
+    for col in ['kind'] + ID_COLUMNS + ['synonyms']:
+        if col not in records.columns:
+            records[col] = ''
+    records = records.fillna('').astype(str)
+    records['kind'] = np.select(
+        [records['kind'] != '', records['lipidmaps'] != '', (records['hmdb'] != '') | (records['kegg'] != '')],
+        [records['kind'], 'lipid', 'metabolite'], default='gene')
+
+    # Primary identifiers come before synonyms so they win on duplicate keys
+    keys, targets = [], []
+    for col in ID_COLUMNS:
+        present = records[col] != ''
+        keys.extend(records.loc[present, col])
+        targets.extend(np.flatnonzero(present.to_numpy()))
+    synonyms = records['synonyms'].str.split('|').explode()
+    synonyms = synonyms[synonyms.str.strip() != '']
+    keys.extend(synonyms)
+    targets.extend(synonyms.index)
+
+    keys = np.array(_normalize(keys))
+    order = np.argsort(keys, kind='stable')
+    keys, first = np.unique(keys[order], return_index=True)
+    targets = np.asarray(targets, dtype=np.int32)[order][first]
+
+    entries = np.empty(len(records), dtype=[(col, _bytes_dtype(records[col])) for col in ['kind'] + ID_COLUMNS])
+    for col in ['kind'] + ID_COLUMNS:
+        entries[col] = np.char.encode(records[col].to_numpy(dtype=str), 'utf-8')
+
+    os.makedirs(out_dir, exist_ok=True)
+    np.save(os.path.join(out_dir, 'keys.npy'), keys)
+    np.save(os.path.join(out_dir, 'targets.npy'), targets)
+    np.save(os.path.join(out_dir, 'entries.npy'), entries)
+
+def _bytes_dtype(values):
+    return f"S{max(1, int(values.str.encode('utf-8').str.len().max() or 1))}"
+
+# --- Lookup ---
+class IdentifierIndex:
+    def __init__(self, directory):
+        self.keys = np.load(os.path.join(directory, 'keys.npy'), mmap_mode='r')
+        self.targets = np.load(os.path.join(directory, 'targets.npy'), mmap_mode='r')
+        self.entries = np.load(os.path.join(directory, 'entries.npy'), mmap_mode='r')
+
+    def lookup(self, names):
+        # Row in entries for each name, or -1 when it is not indexed
+        encoded = _normalize(names)
+        fits = np.fromiter(map(len, encoded), dtype=int, count=len(encoded)) <= self.keys.dtype.itemsize
+        query = np.array(encoded, dtype=self.keys.dtype)
+        pos = np.minimum(np.searchsorted(self.keys, query), len(self.keys) - 1)
+        found = fits & (self.keys[pos] == query)
+        return np.where(found, self.targets[pos], -1)
+
+@lru_cache(maxsize=None)
+def load_index(organism):
+    directory = os.path.join(INDEX_DIR, organism)
+    if not os.path.exists(os.path.join(directory, 'keys.npy')):
+        return None
+    return IdentifierIndex(directory)
+
+def annotate_features(names, organism):
+    names = list(names)
+    annotation = pd.DataFrame({'Feature': names})
+    index = load_index(organism)
+    rows = index.lookup(names) if index is not None and names else np.full(len(names), -1)
+    mapped = rows >= 0
+    hits = index.entries[rows[mapped]] if mapped.any() else None
+    for col in ['kind'] + ID_COLUMNS:
+        values = np.full(len(names), '', dtype=object)
+        if hits is not None:
+            values[mapped] = [v.decode('utf-8') for v in hits[col]]
+        annotation[col] = values
+    annotation.loc[~mapped, 'kind'] = [guess_kind(name) for name in np.asarray(names, dtype=object)[~mapped]]
+    annotation['mapped'] = mapped
+    return annotation
+
+def gene_query_ids(annotation):
+    # g:Profiler accepts gene identifiers only; prefer Ensembl, then symbol
+    genes = annotation[annotation['kind'].isin(['gene', 'unknown'])]
+    ids = genes['ensembl'].where(genes['ensembl'] != '', genes['symbol'])
+    return ids.where(ids != '', genes['Feature']).tolist()
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4 or sys.argv[1] != 'build':
+        sys.exit("usage: python identifiers.py build <organism> <source.tsv> [<source.tsv> ...]")
+    organism, sources = sys.argv[2], sys.argv[3:]
+    records = pd.concat([pd.read_csv(path, sep='\t', dtype=str) for path in sources], ignore_index=True)
+    build_index(records, os.path.join(INDEX_DIR, organism))
+    print(f"Indexed {len(records)} entries for {organism} in {os.path.join(INDEX_DIR, organism)}")
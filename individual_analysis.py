@@ -31,6 +31,9 @@ individual_analysis_layout = html.Div([
     html.Div(id='uploaded-filename', style={'textAlign': 'center', 'color': 'white', 'fontSize': '16px'}),
     html.Br(),
 
+    utils.prefilter_controls('individual-prefilter'),
+    html.Br(),
+
     dbc.Button("🧪 Run Individual Analysis", id='run-individual-analysis', color="info", style={'width': '100%'}),
     html.Br(), html.Br(),
 
@@ -55,9 +58,10 @@ def register_individual_analysis_callbacks(app):
         Input('run-individual-analysis', 'n_clicks'),
         State('upload-omics-data', 'contents'),
         State('upload-omics-data', 'filename'),
+        *utils.prefilter_states('individual-prefilter'),
         prevent_initial_call=True
     )
-    def perform_individual_analysis(n_clicks, contents, filename):
+    def perform_individual_analysis(n_clicks, contents, filename, max_missing, min_variance, top_n):
         if contents is None:
             return "❌ No file uploaded."
 
@@ -65,6 +69,9 @@ def register_individual_analysis_callbacks(app):
         df = utils.parse_uploaded_file(contents, filename)
         df = processing.normalize_transcriptomics(df)
 
+        # Drop near-constant and mostly-missing features before PCA
+        df, prefilter_report = processing.prefilter_features(df, **utils.prefilter_criteria(max_missing, min_variance, top_n))
+
         # Perform PCA
         pca_df = processing.perform_pca(df)
 
@@ -79,6 +86,7 @@ def register_individual_analysis_callbacks(app):
 
         # Return both graph and download button
         return html.Div([
+            html.P(utils.describe_prefilter(prefilter_report), style={'color': 'white'}),
             dcc.Graph(id='pca-graph', figure=fig),
             html.Button("📥 Download PCA Plot", id="download-pca-btn", style={"marginTop": "10px"}),
             dcc.Download(id="pca-download")
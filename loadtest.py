@@ -0,0 +1,120 @@
+# loadtest.py
+# Replays the marker-detection callback concurrently and reports throughput.
+#
+#   python loadtest.py --url local                   # in-process stand-in client, single process
+#   gunicorn -c gunicorn.conf.py app:server &
+#   python loadtest.py --url http://127.0.0.1:8080   # multi-worker server
+
+import argparse
+import base64
+import json
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+CALLBACK_PATH = '/_dash-update-component'
+
+def make_upload(n_samples, n_features, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(rng.lognormal(size=(n_samples, n_features)),
+                      columns=[f"Feature{i}" for i in range(n_features)])
+    df['Group'] = np.where(np.arange(n_samples) % 2 == 0, 'Control', 'Disease')
+    encoded = base64.b64encode(df.to_csv(index=False).encode()).decode()
+    return f"data:text/csv;base64,{encoded}"
+
+def marker_payload(contents, request_no):
+    outputs = [
+        {'id': 'marker-output', 'property': 'children'},
+        {'id': 'marker-volcano-plot', 'property': 'children'},
+        {'id': 'download-marker-section', 'property': 'children'},
+        {'id': 'marker-result-id', 'property': 'data'},
+        {'id': 'marker-dataset-version', 'property': 'data'},
+    ]
+    return {
+        'output': '..' + '...'.join(f"{o['id']}.{o['property']}" for o in outputs) + '..',
+        'outputs': outputs,
+        'inputs': [{'id': 'run-marker-analysis', 'property': 'n_clicks', 'value': request_no + 1}],
+        'changedPropIds': ['run-marker-analysis.n_clicks'],
+        'state': [
+            {'id': 'upload-marker-data', 'property': 'contents', 'value': contents},
+            {'id': 'upload-marker-data', 'property': 'filename', 'value': 'loadtest.csv'},
+            {'id': 'pval-thresh', 'property': 'value', 'value': 0.05},
+            {'id': 'fc-thresh', 'property': 'value', 'value': 2.0},
+            {'id': 'marker-dataset-name', 'property': 'value', 'value': None},
+            {'id': 'marker-prefilter-max-missing', 'property': 'value', 'value': 50},
+            {'id': 'marker-prefilter-min-variance', 'property': 'value', 'value': 0},
+            {'id': 'marker-prefilter-top-n', 'property': 'value', 'value': None},
+        ],
+    }
+
+class LocalClient:
+    # Stand-in for a browser: drives app.server in-process through Flask's test client
+    def __init__(self):
+        import app
+        self.client = app.server.test_client()
+
+    def post(self, payload):
+        try:
+            response = self.client.post(CALLBACK_PATH, json=payload)
+        except Exception:
+            return None
+        return response.status_code
+
+class HttpClient:
+    def __init__(self, url, timeout):
+        self.url = url.rstrip('/') + CALLBACK_PATH
+        self.timeout = timeout
+
+    def post(self, payload):
+        request = urllib.request.Request(self.url, data=json.dumps(payload).encode(),
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+        except OSError:
+            return None
+
+def run(client, contents, n_requests, concurrency):
+    def timed(i):
+        start = time.perf_counter()
+        status = client.post(marker_payload(contents, i))
+        return status, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, range(n_requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([latency for _, latency in results])
+    failures = sum(status != 200 for status, _ in results)
+    print(f"requests:    {n_requests} ({failures} failed), concurrency {concurrency}")
+    if failures:
+        # Failed requests return early, so throughput would be misleading
+        print(f"statuses:    {sorted(set(str(status) for status, _ in results))}")
+        return failures
+    print(f"elapsed:     {elapsed:.2f} s")
+    print(f"throughput:  {n_requests / elapsed:.2f} req/s")
+    print(f"latency p50: {np.percentile(latencies, 50):.2f} s, p95: {np.percentile(latencies, 95):.2f} s")
+    return 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load-test the marker analysis callback.")
+    parser.add_argument('--url', default='local', help="server URL, or 'local' for the in-process client")
+    parser.add_argument('--requests', type=int, default=32)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--samples', type=int, default=100)
+    parser.add_argument('--features', type=int, default=2000)
+    parser.add_argument('--timeout', type=float, default=300)
+    args = parser.parse_args()
+
+    client = LocalClient() if args.url == 'local' else HttpClient(args.url, args.timeout)
+    if run(client, make_upload(args.samples, args.features), args.requests, args.concurrency):
+        sys.exit(1)
@@ -0,0 +1,74 @@
+# mock_gprofiler.py
+# Local stand-in for the g:Profiler API, for exercising pathway queries offline.
+#
+#   python mock_gprofiler.py --port 8765 --fail-every 3 --delay 0.5
+#   GPROFILER_URL=http://127.0.0.1:8765 python app.py
+
+import argparse
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+TERMS = {
+    'KEGG': [('KEGG:05012', "Parkinson disease", 250), ('KEGG:05010', "Alzheimer disease", 380)],
+    'REAC': [('REAC:R-HSA-1430728', "Metabolism", 2000)],
+    'WP': [('WP:WP2371', "Parkinsons disease pathway", 70)],
+    'GO:BP': [('GO:0007399', "nervous system development", 2300)],
+    'GO:MF': [('GO:0005515', "protein binding", 14000)],
+    'GO:CC': [('GO:0005739', "mitochondrion", 1600)],
+}
+
+class MockGProfilerHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        # Number the request on arrival so concurrent requests fail independently
+        with self.server.counter_lock:
+            self.server.requests_seen += 1
+            request_no = self.server.requests_seen
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        time.sleep(self.server.delay)
+        if self.server.fail_every and request_no % self.server.fail_every == 0:
+            self.send_response(503)
+            self.end_headers()
+            return
+        if not self.path.startswith('/api/gost/profile'):
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        query = body.get('query', [])
+        result = []
+        for source in body.get('sources', []):
+            for native, name, term_size in TERMS.get(source, []):
+                result.append({
+                    'source': source, 'native': native, 'name': name,
+                    'p_value': 1e-3 / (1 + len(result)), 'significant': True,
+                    'term_size': term_size, 'query_size': len(query),
+                    'intersection_size': min(len(query), term_size),
+                    'effective_domain_size': 20000, 'query': 'query_1',
+                })
+        payload = json.dumps({'result': result, 'meta': {'organism': body.get('organism')}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(port=8765, delay=0.0, fail_every=0):
+    server = ThreadingHTTPServer(('127.0.0.1', port), MockGProfilerHandler)
+    server.delay = delay
+    server.fail_every = fail_every
+    server.requests_seen = 0
+    server.counter_lock = threading.Lock()
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a mock g:Profiler server.")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--delay', type=float, default=0.0, help="seconds to wait before each response")
+    parser.add_argument('--fail-every', type=int, default=0, help="answer every Nth request with HTTP 503")
+    args = parser.parse_args()
+    serve(args.port, args.delay, args.fail_every).serve_forever()
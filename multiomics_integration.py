@@ -60,6 +60,24 @@ multiomics_integration_layout = html.Div([
     html.Div(id='lipidomics-filename', style={'textAlign': 'center', 'color': 'white'}),
     html.Br(),
 
+    html.H4("Or Upload a Single Workbook (.xlsx, one sheet per omics layer):", style={'color': 'white'}),
+    dcc.Upload(
+        id='upload-workbook',
+        children=html.Div(['📂 Drag and Drop or ', html.A('Select File')]),
+        style={
+            'width': '100%', 'height': '80px', 'lineHeight': '80px',
+            'borderWidth': '2px', 'borderStyle': 'dashed',
+            'borderRadius': '5px', 'textAlign': 'center',
+            'backgroundColor': '#90ee90', 'color': 'black'
+        },
+        multiple=False
+    ),
+    html.Div(id='workbook-filename', style={'textAlign': 'center', 'color': 'white'}),
+    html.Br(),
+
+    utils.prefilter_controls('integration-prefilter'),
+    html.Br(),
+
     dbc.Button("🔄 Integrate and Run PCA", id='run-integration', color="primary", style={'width': '100%', 'fontWeight':'bold', 'color': 'white'}),
     html.Br(), html.Br(),
 
@@ -99,6 +117,16 @@ def register_multiomics_integration_callbacks(app):
             return f"📁 Uploaded: {filename}"
         return ""
 
+    @app.callback(
+        Output('workbook-filename', 'children'),
+        Input('upload-workbook', 'filename'),
+        prevent_initial_call=True
+    )
+    def show_workbook_filename(filename):
+        if filename:
+            return f"📁 Uploaded: {filename}"
+        return ""
+
     @app.callback(
         Output('integration-output', 'children'),
         Input('run-integration', 'n_clicks'),
@@ -108,18 +136,43 @@ def register_multiomics_integration_callbacks(app):
         State('upload-metabolomics', 'filename'),
         State('upload-lipidomics', 'contents'),
         State('upload-lipidomics', 'filename'),
+        State('upload-workbook', 'contents'),
+        State('upload-workbook', 'filename'),
+        *utils.prefilter_states('integration-prefilter'),
         prevent_initial_call=True
     )
     def integrate_and_pca(n_clicks, trans_content, trans_filename,
                           metab_content, metab_filename,
-                          lipid_content, lipid_filename):
-        if None in [trans_content, metab_content, lipid_content]:
-            return "⚠️ Please upload all three omics datasets."
-
-        # Parse uploaded files
-        df_trans = utils.parse_uploaded_file(trans_content, trans_filename)
-        df_metab = utils.parse_uploaded_file(metab_content, metab_filename)
-        df_lipid = utils.parse_uploaded_file(lipid_content, lipid_filename)
+                          lipid_content, lipid_filename,
+                          workbook_content, workbook_filename,
+                          max_missing, min_variance, top_n):
+        if workbook_content is not None:
+            # Parse all sheets of the workbook, one per omics layer
+            try:
+                layers = utils.parse_uploaded_workbook(workbook_content, workbook_filename)
+            except ValueError as e:
+                return f"❌ {str(e)}"
+            missing = [layer for layer in utils.OMICS_SHEET_KEYWORDS if layer not in layers]
+            if missing:
+                return f"⚠️ Workbook is missing sheets for: {', '.join(missing)}."
+            df_trans = layers['transcriptomics']
+            df_metab = layers['metabolomics']
+            df_lipid = layers['lipidomics']
+        elif None in [trans_content, metab_content, lipid_content]:
+            return "⚠️ Please upload all three omics datasets or a single workbook."
+        else:
+            # Parse uploaded files
+            df_trans = utils.parse_uploaded_file(trans_content, trans_filename)
+            df_metab = utils.parse_uploaded_file(metab_content, metab_filename)
+            df_lipid = utils.parse_uploaded_file(lipid_content, lipid_filename)
+
+        # Batch labels may be on any layer; keep them out of the feature matrix
+        batch = None
+        for layer_df in (df_trans, df_metab, df_lipid):
+            if 'Batch' in layer_df.columns:
+                layer_batch = layer_df.pop('Batch')
+                if batch is None:
+                    batch = layer_batch
 
         # Normalize each omics layer
         df_trans = processing.normalize_transcriptomics(df_trans)
@@ -129,6 +182,17 @@ def register_multiomics_integration_callbacks(app):
         # Merge all omics layers
         integrated_df = pd.concat([df_trans, df_metab, df_lipid], axis=1)
 
+        # Remove acquisition batch effects before PCA
+        if batch is not None:
+            try:
+                integrated_df = processing.correct_batch_effects(integrated_df, batch)
+            except ValueError as e:
+                return f"❌ {str(e)}"
+
+        # Drop near-constant and mostly-missing features before PCA
+        integrated_df, prefilter_report = processing.prefilter_features(
+            integrated_df, **utils.prefilter_criteria(max_missing, min_variance, top_n))
+
         # Perform PCA on integrated data
         pca_df = processing.perform_pca(integrated_df)
 
@@ -143,6 +207,8 @@ def register_multiomics_integration_callbacks(app):
 
         return html.Div([
             dbc.Alert("✅ Integration and PCA Completed Successfully!", color="success"),
+            dbc.Alert("ℹ️ Batch effects were corrected using the 'Batch' column.", color="info") if batch is not None else html.Div(),
+            html.P(utils.describe_prefilter(prefilter_report), style={'color': 'white'}),
             dcc.Graph(id='multi-pca-graph', figure=fig),
             html.Button("📥 Download PCA Plot", id="download-multi-pca-btn", style={"marginTop": "10px"}),
             dcc.Download(id="multi-pca-download")
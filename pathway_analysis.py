@@ -7,19 +7,104 @@
 # Stay tuned for the complete integrated code.
 
 from dash import html, dcc, Input, Output, State
+import dash
 import dash_bootstrap_components as dbc
 import dash_table
 import pandas as pd
 import plotly.express as px
-import base64
-import io
 import plotly.io as pio
 import numpy as np
+import os
+import export
+import identifiers
+import processing
+import storage
+import utils
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# --- g:Profiler Enrichment ---
+GPROFILER_URL = os.environ.get('GPROFILER_URL', 'https://biit.cs.ut.ee/gprofiler')
+GPROFILER_TIMEOUT = (5, float(os.environ.get('GPROFILER_TIMEOUT', 60)))
+# Network-bound, so capped separately from DEGENERO_MAX_THREADS
+MAX_CONCURRENT_QUERIES = int(os.environ.get('GPROFILER_MAX_CONCURRENT', 8))
+KEGG_ORGANISM_CODES = {'hsapiens': 'hsa', 'mmusculus': 'mmu', 'drerio': 'dre'}
+
+_session = None
+
+def _gprofiler_session():
+    # One pooled session per process; retries back off on throttling and server errors
+    global _session
+    if _session is None:
+        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=frozenset(['POST']))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENT_QUERIES, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _session = session
+    return _session
+
+def query_gprofiler(organism, query, sources, session=None):
+    session = session or _gprofiler_session()
+    response = session.post(f"{GPROFILER_URL}/api/gost/profile/", json={
+        'organism': organism,
+        'query': list(query),
+        'sources': list(sources),
+        'user_threshold': 0.05,
+        'no_evidences': True,
+    }, timeout=GPROFILER_TIMEOUT)
+    response.raise_for_status()
+    return pd.DataFrame(response.json().get('result', []))
+
+def run_enrichment(queries, sources):
+    # queries maps (organism, subset label) to gene IDs; every combination is
+    # sent concurrently and the successful ones are merged. Returns the merged
+    # table and a list of (organism, subset, error) for queries that failed.
+    jobs = [(organism, subset, ids) for (organism, subset), ids in queries.items() if len(ids) > 0]
+    if not jobs:
+        return pd.DataFrame(), []
+
+    def run_job(job):
+        organism, subset, ids = job
+        result = query_gprofiler(organism, ids, sources)
+        return result.assign(organism=organism, subset=subset)
+
+    results, failed = [], []
+    with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_QUERIES, len(jobs))) as pool:
+        futures = [(job, pool.submit(run_job, job)) for job in jobs]
+        for (organism, subset, _), future in futures:
+            try:
+                results.append(future.result())
+            except requests.RequestException as e:
+                failed.append((organism, subset, str(e)))
+    results = [r for r in results if not r.empty]
+    if not results:
+        return pd.DataFrame(), failed
+    return pd.concat(results, ignore_index=True), failed
+
+def term_url(native, source, organism):
+    # External page for a g:Profiler term, or None for sources without one
+    native = str(native)
+    if source == 'KEGG':
+        return f"https://www.kegg.jp/pathway/{kegg_map_id(native, organism)}"
+    if source == 'REAC':
+        return f"https://reactome.org/content/detail/{native.split(':', 1)[-1]}"
+    if source == 'WP':
+        return f"https://www.wikipathways.org/pathways/{native.split(':', 1)[-1]}"
+    if source.startswith('GO:'):
+        return f"https://amigo.geneontology.org/amigo/term/{native}"
+    return None
+
+def kegg_map_id(native, organism):
+    # g:Profiler reports KEGG terms as 'KEGG:05012'; KEGG pages want 'hsa05012'
+    return KEGG_ORGANISM_CODES.get(organism, 'map') + str(native).split(':')[-1]
 
 # Layout remains same for upload and controls
 pathway_analysis_layout = html.Div([
-    html.H2("🧬 KEGG-Based Pathway Prediction from Multi-Omics Data", style={'color': 'white'}),
+    html.H2("🧬 Pathway Enrichment from Multi-Omics Data", style={'color': 'white'}),
     html.Div([
         html.H4("Upload Multi-Omics Dataset (Transcriptomics, Metabolomics, Lipidomics with Group column)", style={'color': 'white'}),
         dcc.Upload(id='upload-pathway-data',
@@ -33,9 +118,25 @@ pathway_analysis_layout = html.Div([
             {'label': 'Human (hsa)', 'value': 'hsapiens'},
             {'label': 'Mouse (mmu)', 'value': 'mmusculus'},
             {'label': 'Zebrafish (dre)', 'value': 'drerio'}
-        ], value='hsapiens', style={'width': '50%'}),
+        ], value=['hsapiens'], multi=True, style={'width': '50%'}),
+        html.Br(),
+        html.Label("Select Sources:", style={'color': 'white'}),
+        dcc.Checklist(id='pathway-sources', options=[
+            {'label': 'KEGG', 'value': 'KEGG'},
+            {'label': 'Reactome', 'value': 'REAC'},
+            {'label': 'WikiPathways', 'value': 'WP'},
+            {'label': 'GO Biological Process', 'value': 'GO:BP'},
+            {'label': 'GO Molecular Function', 'value': 'GO:MF'},
+            {'label': 'GO Cellular Component', 'value': 'GO:CC'}
+        ], value=['KEGG'], inline=True, labelStyle={'color': 'white', 'marginRight': '15px'}),
+        html.Br(),
+        dcc.Checklist(id='pathway-split-regulation', options=[
+            {'label': 'Query up- and down-regulated features separately', 'value': 'split'}
+        ], value=[], labelStyle={'color': 'white'}),
         html.Br(),
-        dbc.Button("Run KEGG Pathway Prediction", id='run-pathway', color='primary')
+        utils.prefilter_controls('pathway-prefilter'),
+        html.Br(),
+        dbc.Button("Run Pathway Enrichment", id='run-pathway', color='primary')
     ]),
     html.Br(),
     html.Div(id='detected-omics-type', style={'color': 'white', 'fontWeight': 'bold'}),
@@ -45,8 +146,6 @@ pathway_analysis_layout = html.Div([
     html.Div(id='pathway-download-section')
 ])
 
-import gprofiler
-
 def register_pathway_callbacks(app):
     @app.callback(
         Output('uploaded-pathway-filename', 'children'),
@@ -56,6 +155,24 @@ def register_pathway_callbacks(app):
     def update_filename(name):
         return f"✅ Uploaded File: {name}"
 
+    @app.callback(
+        Output('detected-omics-type', 'children'),
+        Input('upload-pathway-data', 'contents'),
+        State('upload-pathway-data', 'filename'),
+        prevent_initial_call=True
+    )
+    def detect_omics_type(contents, filename):
+        if not contents or not filename:
+            return ""
+        try:
+            sniffed = utils.sniff_upload(contents, filename)
+        except Exception as e:
+            return f"❌ Could not read file: {str(e)}"
+        error = utils.validate_sniffed(sniffed)
+        if error:
+            return f"❌ {error}"
+        return f"🔎 {utils.describe_sniffed(sniffed)}"
+
     @app.callback(
         Output('pathway-output', 'children'),
         Output('pathway-plot', 'children'),
@@ -65,51 +182,87 @@ def register_pathway_callbacks(app):
         State('upload-pathway-data', 'contents'),
         State('upload-pathway-data', 'filename'),
         State('organism-select', 'value'),
+        State('pathway-sources', 'value'),
+        State('pathway-split-regulation', 'value'),
+        *utils.prefilter_states('pathway-prefilter'),
         prevent_initial_call=True
     )
-    def analyze_pathway(n, contents, filename, organism):
+    def analyze_pathway(n, contents, filename, organisms, sources, split_regulation, max_missing, min_variance, top_n):
         if not contents:
             return "❌ No file uploaded", None, None, None
 
         try:
-            content_type, content_string = contents.split(',')
-            decoded = base64.b64decode(content_string)
-            df = pd.read_csv(io.StringIO(decoded.decode('utf-8')))
-
-            if 'Group' not in df.columns:
-                return "❌ 'Group' column is required.", None, None, None
+            # Validate from a sample of the upload before the full parse
+            sniffed = utils.sniff_upload(contents, filename)
+            error = utils.validate_sniffed(sniffed)
+            if error:
+                return f"❌ {error}", None, None, None
+            df = utils.parse_uploaded_file(contents, filename, sniffed)
 
             df[df.columns.difference(['SampleID', 'Group'])] = df[df.columns.difference(['SampleID', 'Group'])].apply(pd.to_numeric, errors='coerce')
+            # Drop mostly-missing features first so they do not take whole samples with them
+            df, prefilter_report = processing.prefilter_features(df, **utils.prefilter_criteria(max_missing, min_variance, top_n))
             df.dropna(inplace=True)
 
             groups = df['Group'].unique()
             if len(groups) != 2:
                 return "❌ Exactly two groups are required", None, None, None
 
-            group1 = df[df['Group'] == groups[0]].drop(columns=['SampleID', 'Group'])
-            group2 = df[df['Group'] == groups[1]].drop(columns=['SampleID', 'Group'])
+            group1 = df[df['Group'] == groups[0]].drop(columns=['SampleID', 'Group'], errors='ignore')
+            group2 = df[df['Group'] == groups[1]].drop(columns=['SampleID', 'Group'], errors='ignore')
             diff = group2.mean() - group1.mean()
             significant = diff[abs(diff) > 1.0]
-            significant_ids = significant.index.tolist()
 
-            from gprofiler import GProfiler
-            gp = GProfiler(return_dataframe=True)
-            result = gp.profile(organism=organism, query=significant_ids)
+            if not organisms:
+                return "❌ Please select at least one organism.", None, None, None
+            if not sources:
+                return "❌ Please select at least one source.", None, None, None
+            organisms = [organisms] if isinstance(organisms, str) else organisms
+            if split_regulation:
+                subsets = {'Up': significant[significant > 0].index, 'Down': significant[significant < 0].index}
+            else:
+                subsets = {'All': significant.index}
+
+            # Map features with the local index; only genes are sent to g:Profiler
+            queries, annotation_summary = {}, [html.P(utils.describe_prefilter(prefilter_report), style={'color': 'white'})]
+            for organism in organisms:
+                annotation = identifiers.annotate_features(significant.index, organism)
+                for subset, features in subsets.items():
+                    queries[(organism, subset)] = identifiers.gene_query_ids(annotation[annotation['Feature'].isin(features)])
+                counts = annotation['kind'].value_counts()
+                annotation_summary.append(html.P(
+                    f"🧾 {organism}: {counts.get('gene', 0)} genes, {counts.get('metabolite', 0)} metabolites, "
+                    f"{counts.get('lipid', 0)} lipids, {counts.get('unknown', 0)} unrecognised "
+                    f"({int(annotation['mapped'].sum())} of {len(annotation)} mapped locally)",
+                    style={'color': 'white'}))
+
+            result, failed = run_enrichment(queries, sources)
+            if failed:
+                annotation_summary.append(dbc.Alert(
+                    "⚠️ Some g:Profiler queries failed and are missing from the results: "
+                    + "; ".join(f"{organism} / {subset} ({error})" for organism, subset, error in failed),
+                    color="warning"))
             if result.empty:
-                return "⚠️ No significant pathways found.", None, None, None
+                return html.Div(annotation_summary + ["⚠️ No significant pathways found."]), None, None, None
 
-            result = result[result['source'] == 'KEGG']
             result['completion'] = (result['intersection_size'] / result['term_size']) * 100
-            result = result.sort_values('p_value').head(15)
+            result = result.sort_values('p_value').groupby(['organism', 'subset', 'source']).head(15)
 
             plot = px.bar(result, x='name', y='completion', color='p_value', text='intersection_size',
-                          title='KEGG Pathway Completion %', labels={'name': 'Pathway Name'}, height=500)
-            fig_path = "pathway_enrichment.png"
-            pio.write_image(plot, fig_path)
-            result.to_csv("pathway_enrichment_table.csv", index=False)
+                          facet_row='organism' if len(organisms) > 1 else None,
+                          hover_data=['source', 'subset'],
+                          title='Pathway Completion %', labels={'name': 'Pathway Name'}, height=500 * len(organisms))
+            # Keep the table and figure per run in the shared store rather than
+            # in files that every worker and user would overwrite
+            table_columns = ['organism', 'subset', 'source', 'native', 'name', 'p_value', 'term_size', 'intersection_size', 'completion']
+            dataset_id = export.store_dataset(result[table_columns], 'pathway_enrichment', {
+                'organisms': organisms, 'sources': sources, 'split_regulation': bool(split_regulation),
+                'prefilter': utils.prefilter_criteria(max_missing, min_variance, top_n)
+            }, source_contents=contents, source_filename=filename)
+            storage.put('pathway-plots', dataset_id, plot.to_json())
 
             table = dash_table.DataTable(
-                columns=[{"name": col, "id": col} for col in ['name', 'p_value', 'term_size', 'intersection_size', 'completion']],
+                columns=[{"name": col, "id": col} for col in ['organism', 'subset', 'source', 'name', 'p_value', 'term_size', 'intersection_size', 'completion']],
                 data=result.to_dict('records'),
                 style_table={'overflowX': 'auto'},
                 style_cell={'textAlign': 'left', 'color': 'black'},
@@ -117,7 +270,7 @@ def register_pathway_callbacks(app):
             )
 
             badges = []
-            for _, row in result.iterrows():
+            for _, row in result.drop_duplicates('name').iterrows():
                 path = row['name'].lower()
                 if "parkinson" in path:
                     badges.append(html.Div([html.Span("🧠 Parkinson’s pathway detected!", style={'color': 'lime', 'fontWeight': 'bold'})]))
@@ -126,25 +279,28 @@ def register_pathway_callbacks(app):
 
             preview_links = html.Div([
                 html.Hr(),
-                html.H3("🔗 KEGG Pathway Previews & External Links", style={'color': 'white'}),
+                html.H3("🔗 Pathway Previews & External Links", style={'color': 'white'}),
                 html.Ul([
                     html.Li([
-                        html.A(f"{row['name']} (KEGG Page)", href=f"https://www.kegg.jp/pathway/{row.get('term_id', 'hsa00010')}", target="_blank"),
+                        html.A(f"{row['name']} ({row['source']} Page)", href=term_url(row['native'], row['source'], row['organism']), target="_blank"),
                         html.Br(),
-                        html.Img(src=f"https://www.kegg.jp/kegg/pathway/{row.get('term_id', row.get('native', 'hsa00010'))}.png", style={"maxWidth": "100%", "marginBottom": "20px"})
-                    ]) for _, row in result.iterrows()
+                        html.Img(src=f"https://www.kegg.jp/kegg/pathway/{KEGG_ORGANISM_CODES.get(row['organism'], 'map')}/{kegg_map_id(row['native'], row['organism'])}.png", style={"maxWidth": "100%", "marginBottom": "20px"})
+                        if row['source'] == 'KEGG' else html.Br()
+                    ]) for _, row in result.drop_duplicates(['organism', 'native']).iterrows()
+                    if term_url(row['native'], row['source'], row['organism'])
                 ])
             ])
 
             download_buttons = html.Div([
                 dbc.Button("Download Plot (PNG)", id="btn-dl-png", color="info"),
                 dcc.Download(id="dl-png"),
+                dcc.Store(id='pathway-result-id', data=dataset_id),
                 html.Br(), html.Br(),
-                dbc.Button("Download CSV Table", id="btn-dl-csv", color="secondary"),
-                dcc.Download(id="dl-csv")
+                html.H4("⬇️ Download Enrichment Table", style={'color': 'white'}),
+                export.download_buttons(dataset_id)
             ])
 
-            return html.Div([table] + badges), dcc.Graph(figure=plot), preview_links, download_buttons
+            return html.Div(annotation_summary + [table] + badges), dcc.Graph(figure=plot), preview_links, download_buttons
 
         except Exception as e:
             return f"❌ Error: {str(e)}", None, None, None
@@ -156,16 +312,11 @@ def register_pathway_callbacks(app):
     @app.callback(
         Output("dl-png", "data"),
         Input("btn-dl-png", "n_clicks"),
+        State("pathway-result-id", "data"),
         prevent_initial_call=True
     )
-    def send_png(n):
-        return dcc.send_file("pathway_enrichment.png")
-
-    @app.callback(
-        Output("dl-csv", "data"),
-        Input("btn-dl-csv", "n_clicks"),
-        prevent_initial_call=True
-    )
-    def send_csv(n):
-        return dcc.send_file("pathway_enrichment_table.csv")
-
+    def send_png(n, result_id):
+        figure = storage.get('pathway-plots', result_id)
+        if figure is None:
+            return dash.no_update
+        return dcc.send_bytes(pio.to_image(pio.from_json(figure), format='png'), "pathway_enrichment.png")
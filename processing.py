@@ -1,8 +1,21 @@
+import os
 import numpy as np
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from sklearn.decomposition import PCA
 from sklearn.preprocessing import StandardScaler, MinMaxScaler
 
+# Upper bound for the thread pools a single request may start. Under gunicorn
+# this is set per worker (see gunicorn.conf.py) so concurrent requests share
+# the host's CPUs instead of each using all of them.
+def _available_cpus():
+    return len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+
+MAX_THREADS = max(1, int(os.environ.get('DEGENERO_MAX_THREADS', 0)) or _available_cpus())
+
+def max_threads(n_jobs=None):
+    return max(1, min(n_jobs, MAX_THREADS)) if n_jobs else MAX_THREADS
+
 # --- Normalization Functions ---
 def normalize_transcriptomics(df):
     return np.log2(df + 1)
@@ -24,16 +37,292 @@ def normalize_standard(df):
     return pd.DataFrame(scaled, columns=df.columns)
 
 # --- Missing Value Handling ---
-def handle_missing_values(df, method='mean'):
+def handle_missing_values(df, method='mean', n_neighbors=5, rank=10, max_iter=30, n_jobs=None):
     if method == 'mean':
         return df.fillna(df.mean())
     elif method == 'median':
         return df.fillna(df.median())
     elif method == 'drop':
         return df.dropna()
+    elif method in ('knn', 'svd'):
+        numeric = df.select_dtypes(include=np.number)
+        if numeric.empty or not numeric.isna().values.any():
+            return df
+        X = numeric.to_numpy(dtype=float)
+        if method == 'knn':
+            filled = knn_impute(X, n_neighbors=n_neighbors, n_jobs=n_jobs)
+        else:
+            filled = iterative_svd_impute(X, rank=rank, max_iter=max_iter)
+        return _replace_numeric(df, numeric, filled)
     else:
         return df
 
+def _replace_numeric(df, numeric, values):
+    # Rebuild rather than assign column-by-column, which is slow on wide frames
+    out = pd.DataFrame(values, index=df.index, columns=numeric.columns)
+    if len(numeric.columns) == len(df.columns):
+        return out
+    return pd.concat([df.drop(columns=numeric.columns), out], axis=1)[df.columns]
+
+def _feature_blocks(n_features, n_jobs=None, block_size=2048):
+    n_jobs = max_threads(n_jobs)
+    block_size = max(1, min(block_size, -(-n_features // n_jobs)))
+    return [slice(start, min(start + block_size, n_features))
+            for start in range(0, n_features, block_size)]
+
+def _partial_nan_distances(X, M):
+    # Squared distances and shared-feature counts over co-observed values only
+    X0 = np.where(M, X, 0.0)
+    Mf = M.astype(float)
+    sq = X0 ** 2
+    dist = sq @ Mf.T + Mf @ sq.T - 2.0 * (X0 @ X0.T)
+    return dist, Mf @ Mf.T
+
+def nan_euclidean_distances(X, n_jobs=None):
+    n_jobs = max_threads(n_jobs)
+    M = ~np.isnan(X)
+    blocks = _feature_blocks(X.shape[1], n_jobs)
+    dist = np.zeros((X.shape[0], X.shape[0]))
+    shared = np.zeros_like(dist)
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        for d, c in pool.map(lambda b: _partial_nan_distances(X[:, b], M[:, b]), blocks):
+            dist += d
+            shared += c
+    np.maximum(dist, 0.0, out=dist)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dist = np.sqrt(dist * X.shape[1] / shared)
+    dist[shared == 0] = np.inf
+    return dist
+
+def _knn_fill_block(X, M, order, k):
+    filled = X.copy()
+    col_means = np.nanmean(np.where(M.any(axis=0), X, 0.0), axis=0)
+    n_candidates = min(order.shape[1], 4 * k)
+    for i in np.flatnonzero(~M.all(axis=1)):
+        cols = np.flatnonzero(~M[i])
+        # Try the closest few donors first, widen only for features they lack
+        values, counts = _knn_average(X, M, order[i, :n_candidates], cols, k)
+        short = counts < k
+        if short.any() and n_candidates < order.shape[1]:
+            values[short], counts[short] = _knn_average(X, M, order[i], cols[short], k)
+        with np.errstate(invalid='ignore'):
+            filled[i, cols] = np.where(counts > 0, values / counts, col_means[cols])
+    return filled
+
+def _knn_average(X, M, donors, cols, k):
+    observed = M[np.ix_(donors, cols)]
+    # First k donors (by distance) that observe each missing feature
+    selected = observed & (np.cumsum(observed, axis=0) <= k)
+    values = np.where(selected, X[np.ix_(donors, cols)], 0.0).sum(axis=0)
+    return values, selected.sum(axis=0)
+
+def knn_impute(X, n_neighbors=5, n_jobs=None):
+    n_jobs = max_threads(n_jobs)
+    M = ~np.isnan(X)
+    dist = nan_euclidean_distances(X, n_jobs=n_jobs)
+    np.fill_diagonal(dist, np.inf)
+    # Neighbor order per sample, shared by every feature block
+    order = np.argsort(dist, kind='stable', axis=1)
+    order = order[order != np.arange(len(X))[:, None]].reshape(len(X), -1)
+    blocks = _feature_blocks(X.shape[1], n_jobs)
+    filled = np.empty_like(X)
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        for b, block in zip(blocks, pool.map(lambda b: _knn_fill_block(X[:, b], M[:, b], order, n_neighbors), blocks)):
+            filled[:, b] = block
+    return filled
+
+def iterative_svd_impute(X, rank=10, max_iter=30, tol=1e-3):
+    from sklearn.utils.extmath import randomized_svd
+    M = ~np.isnan(X)
+    col_means = np.nanmean(np.where(M.any(axis=0), X, 0.0), axis=0)
+    centered = np.where(M, X - col_means, 0.0)
+    rank = max(1, min(rank, min(X.shape) - 1))
+    rows, cols = np.nonzero(~M)
+    if len(rows) == 0:
+        return X.copy()
+    # One randomized SVD to start, then a single warm-started subspace
+    # iteration per step; only the missing entries of the fit are formed
+    _, _, Vt = randomized_svd(centered, n_components=rank, random_state=0)
+    filled = centered[rows, cols]
+    for _ in range(max_iter):
+        Q, _ = np.linalg.qr(centered @ Vt.T)
+        Ub, S, Vt = np.linalg.svd(Q.T @ centered, full_matrices=False)
+        left = Q @ (Ub * S)
+        updated = np.einsum('ij,ji->i', left[rows], Vt[:, cols])
+        # Convergence is measured on the imputed entries against their own norm
+        change = np.linalg.norm(updated - filled) / max(np.linalg.norm(filled), 1e-12)
+        centered[rows, cols] = filled = updated
+        if change < tol:
+            break
+    return centered + col_means
+
+# --- Batch Effect Correction ---
+def correct_batch_effects(df, batch, covariates=None, max_iter=100, tol=1e-4):
+    # ComBat-style location/scale adjustment with empirical-Bayes shrinkage,
+    # fitted for all features at once.
+    numeric = df.select_dtypes(include=np.number)
+    X = numeric.to_numpy(dtype=float)
+    if np.isnan(X).any():
+        raise ValueError("Batch correction requires complete data. Please handle missing values first.")
+    batch = pd.Series(np.asarray(batch), index=df.index)
+    levels, batch_idx = np.unique(batch.astype(str), return_inverse=True)
+    if len(levels) < 2:
+        return df
+    B = np.eye(len(levels))[batch_idx]
+    n_per_batch = B.sum(axis=0)
+    if (n_per_batch < 2).any():
+        raise ValueError("Each batch needs at least two samples for batch correction.")
+
+    # Standardize: remove batch and covariate effects, scale by pooled variance
+    design = B
+    if covariates is not None:
+        C = pd.get_dummies(pd.DataFrame(covariates, index=df.index).astype(str), drop_first=True).to_numpy(dtype=float)
+        design = np.hstack([B, C])
+    beta, *_ = np.linalg.lstsq(design, X, rcond=None)
+    grand_mean = (n_per_batch / len(X)) @ beta[:len(levels)]
+    stand_mean = grand_mean + design[:, len(levels):] @ beta[len(levels):]
+    var_pooled = ((X - design @ beta) ** 2).mean(axis=0)
+    # Relative tolerance: lstsq leaves round-off residue on constant features
+    varying = var_pooled > 1e-20 * np.maximum(np.abs(X).max(axis=0), 1.0) ** 2
+    scale = np.sqrt(np.where(varying, var_pooled, 1.0))
+    Z = (X - stand_mean) / scale
+
+    # Batch location/scale estimates and their hyperpriors; constant features
+    # carry no batch information and are left out of the priors
+    if not varying.any():
+        return df
+    batch_sum = B.T @ Z
+    batch_sumsq = B.T @ Z ** 2
+    gamma_hat = batch_sum / n_per_batch[:, None]
+    delta_hat = (batch_sumsq - n_per_batch[:, None] * gamma_hat ** 2) / (n_per_batch[:, None] - 1)
+    delta_hat = np.where(delta_hat > 0, delta_hat, 1.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        gamma_bar = gamma_hat[:, varying].mean(axis=1, keepdims=True)
+        m = delta_hat[:, varying].mean(axis=1, keepdims=True)
+        if varying.sum() > 1:
+            tau2 = gamma_hat[:, varying].var(axis=1, ddof=1, keepdims=True)
+            v = delta_hat[:, varying].var(axis=1, ddof=1, keepdims=True)
+        else:
+            tau2 = v = np.full_like(m, np.nan)
+        a_prior = (2 * v + m ** 2) / v
+        b_prior = (m * v + m ** 3) / v
+    # With a single feature, or identical estimates across features, the
+    # priors are undefined; those batches keep the unshrunk estimates
+    shrink_location = np.isfinite(tau2) & (tau2 > 0)
+    shrink_scale = np.isfinite(a_prior) & np.isfinite(b_prior) & (v > 0)
+
+    # Iterate the posterior means jointly for every batch and feature
+    n = n_per_batch[:, None]
+    gamma_star, delta_star = gamma_hat, delta_hat
+    for _ in range(max_iter):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            gamma_new = np.where(shrink_location,
+                                 (n * tau2 * gamma_hat + delta_star * gamma_bar) / (n * tau2 + delta_star), gamma_hat)
+            sum2 = batch_sumsq - 2 * gamma_new * batch_sum + n * gamma_new ** 2
+            unshrunk = sum2 / (n - 1)
+            delta_new = np.where(shrink_scale, (0.5 * sum2 + b_prior) / (n / 2 + a_prior - 1),
+                                 np.where(unshrunk > 0, unshrunk, 1.0))
+        change = max(np.max(np.abs(gamma_new - gamma_star) / np.maximum(np.abs(gamma_star), 1e-12)),
+                     np.max(np.abs(delta_new - delta_star) / delta_star))
+        gamma_star, delta_star = gamma_new, delta_new
+        if change < tol:
+            break
+
+    adjusted = (Z - gamma_star[batch_idx]) / np.sqrt(delta_star[batch_idx]) * scale + stand_mean
+    adjusted[:, ~varying] = X[:, ~varying]
+    return _replace_numeric(df, numeric, adjusted)
+
+# --- Streaming Group Statistics ---
+def summarize_groups(df, groups):
+    # Per-group observed counts, means and sums of squared deviations (M2)
+    X = df.to_numpy(dtype=float)
+    observed = ~np.isnan(X)
+    groups = np.asarray(groups)
+    summary = {}
+    for label in pd.unique(groups):
+        rows = groups == label
+        obs = observed[rows]
+        n = obs.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(obs, X[rows], 0.0).sum(axis=0) / n
+        m2 = (np.where(obs, X[rows] - mean, 0.0) ** 2).sum(axis=0)
+        summary[label] = {'n': n, 'mean': mean, 'm2': m2}
+    return summary
+
+def merge_summaries(a, b):
+    # Chan et al. pairwise update; features unseen on one side take the other
+    n = a['n'] + b['n']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        delta = b['mean'] - a['mean']
+        mean = np.where(a['n'] == 0, b['mean'], np.where(b['n'] == 0, a['mean'], a['mean'] + delta * b['n'] / n))
+        m2 = np.where((a['n'] == 0) | (b['n'] == 0), np.nan_to_num(a['m2']) + np.nan_to_num(b['m2']),
+                      a['m2'] + b['m2'] + delta ** 2 * a['n'] * b['n'] / n)
+    return {'n': n, 'mean': mean, 'm2': m2}
+
+def combine_group_summaries(summary):
+    stats = list(summary.values())
+    combined = stats[0]
+    for other in stats[1:]:
+        combined = merge_summaries(combined, other)
+    return combined
+
+# --- Feature Prefilter ---
+def feature_metrics(df):
+    # One pass over the numeric matrix: observed count, mean, variance, CV
+    numeric = df.select_dtypes(include=np.number)
+    X = numeric.to_numpy(dtype=float)
+    observed = ~np.isnan(X)
+    n = observed.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(observed, X, 0.0).sum(axis=0) / n
+        variance = (np.where(observed, X - mean, 0.0) ** 2).sum(axis=0) / (n - 1)
+    return _metrics_frame(numeric.columns, n, mean, variance, len(X))
+
+def summary_metrics(summary, features, n_samples):
+    # Same metrics from running group summaries (see summarize_groups)
+    overall = combine_group_summaries(summary)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variance = overall['m2'] / (overall['n'] - 1)
+    return _metrics_frame(features, overall['n'], overall['mean'], variance, n_samples)
+
+def _metrics_frame(features, n, mean, variance, n_samples):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cv = np.sqrt(variance) / np.abs(mean)
+    return pd.DataFrame({
+        'Feature': list(features),
+        'mean': mean,
+        'variance': variance,
+        'missing_fraction': 1 - n / max(n_samples, 1),
+        'cv': cv
+    })
+
+def select_features(metrics, max_missing=None, min_variance=None, min_mean=None, min_cv=None,
+                    top_n=None, rank_by='variance'):
+    # Marks each feature kept or dropped; 'reason' names the first failed criterion
+    report = metrics.copy()
+    report['reason'] = ''
+    checks = [
+        ('missing', max_missing, lambda m: m['missing_fraction'] <= max_missing),
+        ('low variance', min_variance, lambda m: m['variance'] > min_variance),
+        ('low abundance', min_mean, lambda m: m['mean'] >= min_mean),
+        ('low CV', min_cv, lambda m: m['cv'] >= min_cv),
+    ]
+    for reason, threshold, passes in checks:
+        if threshold is not None:
+            report.loc[(report['reason'] == '') & ~passes(report), 'reason'] = reason
+    if top_n is not None:
+        remaining = report.index[report['reason'] == '']
+        ranked = report.loc[remaining, rank_by].fillna(-np.inf).sort_values(ascending=False, kind='stable')
+        report.loc[ranked.index[int(top_n):], 'reason'] = f'outside top {int(top_n)}'
+    report['kept'] = report['reason'] == ''
+    return report
+
+def prefilter_features(df, **criteria):
+    # Non-numeric columns (Group, SampleID, Batch) are always kept
+    report = select_features(feature_metrics(df), **criteria)
+    dropped = set(report.loc[~report['kept'], 'Feature'])
+    return df[[c for c in df.columns if c not in dropped]], report
+
 # --- PCA Analysis ---
 def perform_pca(df, n_components=2):
     df = df.dropna(axis=1, how='any')  # Drop columns with missing values
@@ -60,3 +349,23 @@ def generate_volcano_data(df, group1_idx, group2_idx, threshold_p=0.05, threshol
     volcano_df['Significant'] = (volcano_df['p-value'] < threshold_p) & (abs(volcano_df['FoldChange']) > threshold_fc)
     return volcano_df
 
+
+# --- Clustered Heatmap Helpers ---
+def cluster_order(matrix, method='average', metric='euclidean'):
+    # Condensed distances keep memory at O(n^2); scipy runs average/complete/
+    # ward linkage with the nearest-neighbor-chain algorithm.
+    from scipy.cluster.hierarchy import linkage, leaves_list
+    from scipy.spatial.distance import pdist
+    if len(matrix) < 3:
+        return np.arange(len(matrix))
+    return leaves_list(linkage(pdist(matrix, metric=metric), method=method))
+
+def downsample_matrix(matrix, max_rows=200, max_cols=200):
+    # Average contiguous blocks so at most max_rows x max_cols cells remain
+    row_bins = np.array_split(np.arange(matrix.shape[0]), min(max_rows, matrix.shape[0]))
+    col_bins = np.array_split(np.arange(matrix.shape[1]), min(max_cols, matrix.shape[1]))
+    row_starts = [b[0] for b in row_bins]
+    col_starts = [b[0] for b in col_bins]
+    summed = np.add.reduceat(np.add.reduceat(matrix, row_starts, axis=0), col_starts, axis=1)
+    counts = np.outer([len(b) for b in row_bins], [len(b) for b in col_bins])
+    return summed / counts, row_bins, col_bins
@@ -0,0 +1,75 @@
+import os
+import pickle
+import tempfile
+import hashlib
+import fcntl
+from contextlib import contextmanager
+
+# On-disk cache and dataset store shared by every server worker
+CACHE_DIR = os.environ.get('DEGENERO_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'degenero-cache'))
+MAX_ENTRIES = int(os.environ.get('DEGENERO_CACHE_MAX_ENTRIES', 64))
+
+def _path(namespace, key):
+    digest = hashlib.sha1(str(key).encode()).hexdigest()
+    return os.path.join(CACHE_DIR, namespace, f"{digest}.pkl")
+
+def put(namespace, key, value, evict=True):
+    path = _path(namespace, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temporary file first so other workers never read a partial entry
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if evict:
+        prune(namespace)
+
+def get(namespace, key, default=None):
+    try:
+        with open(_path(namespace, key), 'rb') as f:
+            return pickle.load(f)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return default
+
+def contains(namespace, key):
+    return os.path.exists(_path(namespace, key))
+
+def memoize(namespace, key, compute):
+    value = get(namespace, key)
+    if value is None:
+        value = compute()
+        put(namespace, key, value)
+    return value
+
+@contextmanager
+def lock(namespace, key):
+    # Exclusive lock held across workers for read-modify-write updates of one entry
+    path = _path(namespace, key)[:-len('.pkl')] + '.lock'
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def prune(namespace, max_entries=None):
+    max_entries = max_entries or MAX_ENTRIES
+    directory = os.path.join(CACHE_DIR, namespace)
+    try:
+        entries = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.pkl')]
+    except FileNotFoundError:
+        return
+    if len(entries) <= max_entries:
+        return
+    entries.sort(key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0)
+    for path in entries[:len(entries) - max_entries]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
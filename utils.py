@@ -1,19 +1,287 @@
 import pandas as pd
+import numpy as np
 import io
+import csv
 import base64
 
+# Sheet-name keywords used to route workbook sheets to omics layers
+OMICS_SHEET_KEYWORDS = {
+    'transcriptomics': ('transcript', 'gene', 'rna', 'expression'),
+    'metabolomics': ('metabol', 'metabo', 'compound'),
+    'lipidomics': ('lipid',),
+}
+
+# Upload sniffing reads only this much of a CSV before the full parse
+SNIFF_BYTES = 64 * 1024
+SNIFF_ROWS = 50
+SNIFF_DTYPE_ROWS = 10
+ID_COLUMN = 'SampleID'
+GROUP_COLUMN = 'Group'
+FEATURE_KIND_LAYERS = {'gene': 'transcriptomics', 'metabolite': 'metabolomics', 'lipid': 'lipidomics'}
+
 # Helper function to parse uploaded file
-def parse_uploaded_file(contents, filename):
+def parse_uploaded_file(contents, filename, sniffed=None):
     content_type, content_string = contents.split(',')
     decoded = base64.b64decode(content_string)
     try:
         if filename.endswith('.csv'):
-            df = pd.read_csv(io.StringIO(decoded.decode('utf-8')))
+            df = _read_csv(decoded, sniffed)
         elif filename.endswith('.xlsx'):
-            df = pd.read_excel(io.BytesIO(decoded))
+            df = read_excel_sheet(decoded)
         else:
             raise ValueError("Unsupported file format. Please upload a CSV or Excel file.")
+        if sniffed is not None and sniffed['orientation'] == 'columns':
+            df = _apply_sniffed_dtypes(_transpose_samples(df), sniffed)
     except Exception as e:
         raise ValueError(f"There was an error processing the file: {e}")
     return df
 
+def _read_csv(decoded, sniffed=None):
+    text = io.StringIO(decoded.decode('utf-8'))
+    if sniffed is None or sniffed['orientation'] == 'columns':
+        df = pd.read_csv(text, sep=sniffed['delimiter'] if sniffed else ',', skipinitialspace=True)
+        df.columns = [str(c).strip() for c in df.columns]
+        return df
+    # The sniffer strips header names; map them back to the raw ones for pandas
+    raw = {str(c).strip(): c for c in pd.read_csv(text, sep=sniffed['delimiter'], skipinitialspace=True, nrows=0).columns}
+    try:
+        text.seek(0)
+        df = pd.read_csv(text, sep=sniffed['delimiter'], skipinitialspace=True,
+                         usecols=[raw[c] for c in sniffed['usecols']],
+                         dtype={raw[c]: t for c, t in sniffed['dtypes'].items()})
+    except (ValueError, KeyError):
+        # Text further down a numeric column; read everything and leave
+        # coercion to the caller
+        text.seek(0)
+        df = pd.read_csv(text, sep=sniffed['delimiter'], skipinitialspace=True)
+    df.columns = [str(c).strip() for c in df.columns]
+    return df
+
+def _apply_sniffed_dtypes(df, sniffed):
+    numeric = [c for c in sniffed['numeric_columns'] if c in df.columns]
+    try:
+        df[numeric] = df[numeric].astype(float)
+    except ValueError:
+        df[numeric] = df[numeric].apply(pd.to_numeric, errors='coerce')
+    return df
+
+def _transpose_samples(df):
+    # Features as rows, samples as columns: first column holds the row labels
+    # and the header holds the sample IDs unless a SampleID row is present
+    df = df.set_index(df.columns[0]).T
+    df.columns = [str(c).strip() for c in df.columns]
+    df.columns.name = None
+    if ID_COLUMN not in df.columns:
+        df.insert(0, ID_COLUMN, df.index)
+    return df.reset_index(drop=True)
+
+# --- Upload Sniffing ---
+def sniff_upload(contents, filename):
+    content_type, content_string = contents.split(',')
+    if filename.endswith('.csv'):
+        # Wide files only need enough lines for dtypes; narrow ones give up to SNIFF_ROWS
+        lines = _decode_csv_prefix(content_string, SNIFF_DTYPE_ROWS + 1).splitlines()[:SNIFF_ROWS + 1]
+        delimiter = max(',;\t|', key=lines[0].count) if lines else ','
+        rows = list(csv.reader(lines, delimiter=delimiter))
+        header = [name.strip() for name in rows[0]] if rows else []
+        rows = rows[1:]
+    elif filename.endswith('.xlsx'):
+        delimiter = None
+        sample = read_excel_sheet(base64.b64decode(content_string), nrows=SNIFF_ROWS)
+        header, rows = list(sample.columns), sample.astype(object).values.tolist()
+    else:
+        raise ValueError("Unsupported file format. Please upload a CSV or Excel file.")
+    if not header:
+        raise ValueError("The uploaded file is empty.")
+
+    # Pad ragged rows so the sample is a rectangular object block
+    block = np.full((len(rows), len(header)), None, dtype=object)
+    for i, row in enumerate(rows):
+        block[i, :min(len(row), len(header))] = row[:len(header)]
+    block[block == ''] = None
+
+    orientation = 'rows'
+    first_column = [str(v).strip() for v in block[:, 0]] if len(block) else []
+    if GROUP_COLUMN not in header and (GROUP_COLUMN in first_column or ID_COLUMN in first_column):
+        orientation = 'columns'
+        header, block = first_column, block[:, 1:].T
+
+    labels = [c for c in (ID_COLUMN, GROUP_COLUMN) if c in header]
+    candidates = [i for i, name in enumerate(header) if name not in labels]
+    # Numeric when at least 90% of the sampled values parse as numbers
+    values = block[:SNIFF_DTYPE_ROWS, candidates]
+    converted = pd.to_numeric(pd.Series(values.ravel()), errors='coerce').to_numpy().reshape(values.shape)
+    present = pd.notna(values).sum(axis=0)
+    parsed = pd.notna(converted).sum(axis=0)
+    is_numeric = (present == 0) | (parsed >= 0.9 * present)
+    numeric_columns = [header[i] for i, n in zip(candidates, is_numeric) if n]
+    text_columns = [header[i] for i, n in zip(candidates, is_numeric) if not n]
+
+    return {
+        'delimiter': delimiter,
+        'orientation': orientation,
+        'id_column': ID_COLUMN if ID_COLUMN in labels else None,
+        'group_column': GROUP_COLUMN if GROUP_COLUMN in labels else None,
+        'numeric_columns': numeric_columns,
+        'text_columns': text_columns,
+        'omics_type': guess_omics_type(numeric_columns),
+        'usecols': labels + numeric_columns,
+        'dtypes': {**{col: 'float64' for col in numeric_columns}, **{col: 'str' for col in labels}},
+    }
+
+def _decode_csv_prefix(content_string, n_lines):
+    # base64 decodes in 4-char groups of 3 bytes, so a prefix can be decoded
+    # without touching the rest; grow it only for very wide headers.
+    n_bytes = SNIFF_BYTES
+    while True:
+        n_chars = -(-n_bytes // 3) * 4
+        text = base64.b64decode(content_string[:n_chars]).decode('utf-8', errors='ignore')
+        if len(content_string) <= n_chars:
+            return text
+        if text.count('\n') >= n_lines:
+            return text[:text.rfind('\n') + 1]
+        # Once the header is complete, size the next read from its length
+        header_length = text.find('\n')
+        n_bytes = max(2 * n_bytes, int(1.2 * header_length * (n_lines + 1))) if header_length >= 0 else 4 * n_bytes
+
+def guess_omics_type(feature_names):
+    import identifiers
+    kinds = pd.Series([identifiers.guess_kind(name) for name in feature_names], dtype=object)
+    # Fall back to name keywords (e.g. 'GeneA', 'MetB', 'LipC')
+    lowered = pd.Series([str(name).lower() for name in feature_names], dtype=object)
+    for kind, keywords in (('gene', ('gene', 'ens')), ('metabolite', ('met', 'hmdb')), ('lipid', ('lip',))):
+        unknown = kinds == 'unknown'
+        kinds[unknown & lowered.str.startswith(keywords)] = kind
+    counts = kinds[kinds != 'unknown'].map(FEATURE_KIND_LAYERS).value_counts()
+    if counts.empty:
+        return 'unknown'
+    if len(counts) > 1 and counts.iloc[1] >= 0.2 * counts.sum():
+        return 'multi-omics'
+    return counts.index[0]
+
+def validate_sniffed(sniffed, require_group=True, require_id=False):
+    # Returns an error message, or None when the upload looks usable
+    if require_group and sniffed['group_column'] is None:
+        return f"'{GROUP_COLUMN}' column is required."
+    if require_id and sniffed['id_column'] is None:
+        return f"'{ID_COLUMN}' column is required."
+    if not sniffed['numeric_columns']:
+        return "No numeric feature columns were found."
+    return None
+
+def describe_sniffed(sniffed):
+    layout = 'samples as rows' if sniffed['orientation'] == 'rows' else 'samples as columns (transposed)'
+    return (f"Detected omics type: {sniffed['omics_type']} · {len(sniffed['numeric_columns'])} numeric features · {layout}"
+            + (f" · {len(sniffed['text_columns'])} non-numeric columns ignored" if sniffed['text_columns'] else ""))
+
+# --- Excel Workbooks ---
+def list_excel_sheets(decoded):
+    wb = _open_workbook(decoded)
+    try:
+        return list(wb.sheetnames)
+    finally:
+        wb.close()
+
+def _open_workbook(decoded):
+    from openpyxl import load_workbook
+    return load_workbook(io.BytesIO(decoded), read_only=True, data_only=True)
+
+def _sheet_frame(ws, nrows=None):
+    rows = ws.iter_rows(values_only=True)
+    header = next(rows, None)
+    if header is None:
+        return pd.DataFrame()
+    keep = [i for i, name in enumerate(header) if name is not None]
+    columns = [str(header[i]) for i in keep]
+    data = []
+    for row in rows:
+        if nrows is not None and len(data) >= nrows:
+            break
+        if any(v is not None for v in row):
+            data.append([row[i] if i < len(row) else None for i in keep])
+    return pd.DataFrame(data, columns=columns)
+
+def read_excel_sheet(decoded, sheet_name=None, nrows=None):
+    wb = _open_workbook(decoded)
+    try:
+        return _sheet_frame(wb[sheet_name] if sheet_name is not None else wb.worksheets[0], nrows)
+    finally:
+        wb.close()
+
+def read_excel_sheets(decoded):
+    # openpyxl parses in pure Python, so threads gain nothing under the GIL and
+    # per-request process pools cost more than they save inside server
+    # workers. One read-only workbook streams every sheet in turn and loads
+    # the shared strings once.
+    wb = _open_workbook(decoded)
+    try:
+        return {name: _sheet_frame(wb[name]) for name in wb.sheetnames}
+    finally:
+        wb.close()
+
+def map_sheets_to_omics(sheets):
+    layers = {}
+    unmatched = []
+    for name, df in sheets.items():
+        lowered = name.lower()
+        layer = next((layer for layer, keywords in OMICS_SHEET_KEYWORDS.items()
+                      if layer not in layers and any(k in lowered for k in keywords)), None)
+        if layer is None:
+            unmatched.append(df)
+        else:
+            layers[layer] = df
+    # Sheets without a recognisable name fill the remaining layers in order
+    for layer in OMICS_SHEET_KEYWORDS:
+        if layer not in layers and unmatched:
+            layers[layer] = unmatched.pop(0)
+    return layers
+
+def parse_uploaded_workbook(contents, filename):
+    content_type, content_string = contents.split(',')
+    decoded = base64.b64decode(content_string)
+    if not filename.endswith('.xlsx'):
+        raise ValueError("Please upload an Excel workbook (.xlsx) with one sheet per omics layer.")
+    try:
+        sheets = read_excel_sheets(decoded)
+    except Exception as e:
+        raise ValueError(f"There was an error processing the workbook: {e}")
+    return map_sheets_to_omics(sheets)
+
+# --- Feature Prefilter Controls ---
+def prefilter_controls(prefix):
+    from dash import dcc, html
+    import dash_bootstrap_components as dbc
+    label_style = {'color': 'white'}
+    return html.Div([
+        html.H5("🧹 Feature Prefilter", style=label_style),
+        dbc.Row([
+            dbc.Col([
+                html.Label("Max Missing (%)", style=label_style),
+                dcc.Input(id=f'{prefix}-max-missing', type='number', min=0, max=100, step=1, value=50)
+            ], width=3),
+            dbc.Col([
+                html.Label("Min Variance", style=label_style),
+                dcc.Input(id=f'{prefix}-min-variance', type='number', min=0, value=0)
+            ], width=3),
+            dbc.Col([
+                html.Label("Keep Top-N by Variance (blank = all)", style=label_style),
+                dcc.Input(id=f'{prefix}-top-n', type='number', min=1, step=1, value=None)
+            ], width=4)
+        ])
+    ])
+
+def prefilter_states(prefix):
+    from dash import State
+    return [State(f'{prefix}-max-missing', 'value'), State(f'{prefix}-min-variance', 'value'), State(f'{prefix}-top-n', 'value')]
+
+def prefilter_criteria(max_missing, min_variance, top_n):
+    return {
+        'max_missing': None if max_missing is None else max_missing / 100,
+        'min_variance': min_variance,
+        'top_n': top_n or None,
+    }
+
+def describe_prefilter(report):
+    dropped = report.loc[~report['kept'], 'reason'].value_counts()
+    details = ', '.join(f"{count} {reason}" for reason, count in dropped.items())
+    return f"Prefilter kept {int(report['kept'].sum())} of {len(report)} features" + (f" (dropped: {details})" if details else "")
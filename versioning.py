@@ -0,0 +1,119 @@
+# versioning.py
+# Versioned datasets that grow by appending samples. Each append stores only
+# the new samples and folds them into running per-group summaries and an
+# incremental PCA, so refreshing results costs time proportional to the
+# new samples rather than the whole cohort.
+
+import datetime
+import hashlib
+import numpy as np
+import pandas as pd
+import processing
+import storage
+
+N_COMPONENTS = 2
+LABEL_COLUMNS = ('SampleID', 'Group')
+
+def load_state(name):
+    return storage.get('dataset-versions', name)
+
+def append_samples(name, df, group_column='Group', max_groups=None, source_contents=None):
+    # Returns (state, appended); an upload that is already stored is not appended again.
+    # The dataset is locked so concurrent appends from other workers cannot drop an update.
+    with storage.lock('dataset-versions', name):
+        return _append_samples(name, df, group_column, max_groups, source_contents)
+
+def _append_samples(name, df, group_column, max_groups, source_contents):
+    input_sha256 = hashlib.sha256(source_contents.encode()).hexdigest() if source_contents else None
+    state = load_state(name)
+    if state is not None and input_sha256 is not None and any(v['input_sha256'] == input_sha256 for v in state['versions']):
+        return state, False
+
+    groups = df[group_column].astype(str).reset_index(drop=True)
+    sample_ids = df['SampleID'].astype(str).reset_index(drop=True) if 'SampleID' in df.columns else None
+    features = df.drop(columns=[c for c in LABEL_COLUMNS if c in df.columns]).apply(pd.to_numeric, errors='coerce')
+    features = features.reset_index(drop=True)
+    if sample_ids is not None and sample_ids.duplicated().any():
+        raise ValueError(f"Duplicate SampleID in upload (e.g. {sample_ids[sample_ids.duplicated()].iloc[0]}).")
+    if state is None:
+        state = {'name': name, 'features': list(features.columns), 'groups': [], 'summary': {},
+                 'pca': None, 'pca_pending': None, 'versions': [], 'sample_ids': []}
+    else:
+        if sample_ids is not None:
+            repeated = sample_ids[sample_ids.isin(set(state.get('sample_ids', [])))]
+            if len(repeated):
+                raise ValueError(f"{len(repeated)} samples are already in dataset '{name}' (e.g. {repeated.iloc[0]}).")
+        missing = [c for c in state['features'] if c not in features.columns]
+        if missing:
+            raise ValueError(f"New samples are missing {len(missing)} features of dataset '{name}' (e.g. {missing[0]}).")
+        features = features[state['features']]
+
+    new_groups = [g for g in pd.unique(groups) if g not in state['groups']]
+    if max_groups is not None and len(state['groups']) + len(new_groups) > max_groups:
+        raise ValueError(f"Dataset '{name}' would have more than {max_groups} groups after this append.")
+
+    # Fold the new samples into the running per-group summaries
+    for label, stats in processing.summarize_groups(features, groups).items():
+        summary = state['summary'].get(label)
+        state['summary'][label] = stats if summary is None else processing.merge_summaries(summary, stats)
+    state['groups'].extend(new_groups)
+    if sample_ids is not None:
+        state.setdefault('sample_ids', []).extend(sample_ids)
+
+    _update_pca(state, features.to_numpy(dtype=float))
+
+    version = len(state['versions']) + 1
+    n_samples = (state['versions'][-1]['n_samples'] if state['versions'] else 0) + len(features)
+    labels = [groups.rename(group_column)] if sample_ids is None else [sample_ids.rename('SampleID'), groups.rename(group_column)]
+    storage.put('dataset-chunks', (name, version), pd.concat(labels + [features], axis=1), evict=False)
+    state['versions'].append({
+        'version': version,
+        'added': len(features),
+        'n_samples': n_samples,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'input_sha256': input_sha256,
+    })
+    storage.put('dataset-versions', name, state, evict=False)
+    return state, True
+
+def _update_pca(state, X):
+    from sklearn.decomposition import IncrementalPCA
+    overall = processing.combine_group_summaries(state['summary'])
+    X = np.where(np.isnan(X), np.nan_to_num(overall['mean']), X)
+    # partial_fit needs at least n_components rows per batch; hold back small appends
+    if state['pca_pending'] is not None:
+        X = np.vstack([state['pca_pending'], X])
+    n_components = min(N_COMPONENTS, X.shape[1])
+    if len(X) < n_components:
+        state['pca_pending'] = X
+        return
+    if state['pca'] is None:
+        state['pca'] = IncrementalPCA(n_components=n_components)
+    state['pca'].partial_fit(X)
+    state['pca_pending'] = None
+
+def load_samples(name, version=None):
+    # All samples up to and including `version` (default: the latest)
+    state = load_state(name)
+    if state is None:
+        return None
+    chunks = [storage.get('dataset-chunks', (name, v['version'])) for v in state['versions']
+              if version is None or v['version'] <= version]
+    return pd.concat(chunks, ignore_index=True)
+
+def pca_scores(name):
+    # Project every stored sample with the current incremental model
+    state = load_state(name)
+    if state is None or state['pca'] is None:
+        return None
+    overall = processing.combine_group_summaries(state['summary'])
+    frames = []
+    for v in state['versions']:
+        chunk = storage.get('dataset-chunks', (name, v['version']))
+        X = chunk[state['features']].to_numpy(dtype=float)
+        X = np.where(np.isnan(X), np.nan_to_num(overall['mean']), X)
+        scores = pd.DataFrame(state['pca'].transform(X), columns=[f'PC{i+1}' for i in range(state['pca'].n_components_)])
+        scores['Group'] = chunk['Group'].to_numpy()
+        scores['Version'] = v['version']
+        frames.append(scores)
+    return pd.concat(frames, ignore_index=True)